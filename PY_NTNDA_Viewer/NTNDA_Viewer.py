@@ -11,11 +11,11 @@ latest date 2020.07.21
     original development started 2019.12
 """
 
-import sys, time
+import sys, time, math
 import numpy as np
 from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit
 from PyQt5.QtWidgets import QPushButton, QHBoxLayout, QGridLayout
-from PyQt5.QtWidgets import QRadioButton
+from PyQt5.QtWidgets import QRadioButton, QCheckBox
 from PyQt5.QtCore import *
 from PyQt5.QtGui import qRgb
 
@@ -23,7 +23,7 @@ sys.path.append("../numpyImage/")
 from numpyImage import NumpyImage, FollowMouse
 
 sys.path.append("../codecAD/")
-from codecAD import CodecAD
+from codecAD import CodecAD, CodecFrame
 
 sys.path.append("../channelToImageAD/")
 from channelToImageAD import ChannelToImageAD
@@ -31,17 +31,23 @@ from channelToImageAD import ChannelToImageAD
 sys.path.append("../colorTable/")
 from colorTable import ColorTable
 
+sys.path.append("../latencyStats/")
+from latencyStats import LatencyStats
+
 
 class NTNDA_Viewer(QWidget):
     def __init__(self, ntnda_Channel_Provider, providerName, parent=None):
         super(QWidget, self).__init__(parent)
         self.imageSize = 800
+        # images per second shown by numpyImage. Faster images are dropped.
+        self.displayRate = 60
         self.isClosed = False
         self.provider = ntnda_Channel_Provider
         self.provider.NTNDA_Viewer = self
         self.setWindowTitle(providerName + "_NTNDA_Viewer")
         self.codecAD = CodecAD()
         self.channelToImage = ChannelToImageAD()
+        self.latencyStats = LatencyStats()
         self.colorTable = ColorTable()
         self.colorTable.setColorChangeCallback(self.colorChangeEvent)
         self.colorTable.setExceptionCallback(self.colorExceptionEvent)
@@ -49,8 +55,16 @@ class NTNDA_Viewer(QWidget):
         self.numpyImage = None
         self.manualLimits = False
         self.nImages = 0
+        self.nDisplayed = 0
         self.zoomScale = 1
         self.codecIsNone = True
+        # only the latest frame is decompressed and displayed.
+        # Frames are processed at most displayRate times per second.
+        self.frame = None
+        self.frameTimer = QTimer()
+        self.frameTimer.setTimerType(Qt.PreciseTimer)
+        self.frameTimer.setInterval(max(int(round(1000.0 / self.displayRate)), 1))
+        self.frameTimer.timeout.connect(self.frameTimerEvent)
         # first row
         box = QHBoxLayout()
         box.setContentsMargins(0, 0, 0, 0)
@@ -86,7 +100,8 @@ class NTNDA_Viewer(QWidget):
         imageRateLabel = QLabel("imageRate:")
         box.addWidget(imageRateLabel)
         self.imageRateText = QLabel()
-        self.imageRateText.setFixedWidth(40)
+        self.imageRateText.setFixedWidth(70)
+        self.imageRateText.setToolTip("received/displayed images per second")
         box.addWidget(self.imageRateText)
         if len(self.provider.getChannelName()) < 1:
             name = os.getenv("EPICS_NTNDA_VIEWER_CHANNELNAME")
@@ -129,9 +144,15 @@ class NTNDA_Viewer(QWidget):
         self.autoScaleButton = QRadioButton("autoScale")
         self.autoScaleButton.toggled.connect(self.scaleEvent)
         self.autoScaleButton.setChecked(True)
+        self.approxScaleButton = QRadioButton("approxScale")
+        self.approxScaleButton.toggled.connect(self.scaleEvent)
+        self.percentileScaleButton = QRadioButton("percentileScale")
+        self.percentileScaleButton.toggled.connect(self.scaleEvent)
         self.manualScaleButton = QRadioButton("manualScale")
         self.manualScaleButton.toggled.connect(self.scaleEvent)
         hbox.addWidget(self.autoScaleButton)
+        hbox.addWidget(self.approxScaleButton)
+        hbox.addWidget(self.percentileScaleButton)
         hbox.addWidget(self.manualScaleButton)
         wid = QWidget()
         wid.setLayout(hbox)
@@ -186,6 +207,22 @@ class NTNDA_Viewer(QWidget):
         box.addWidget(self.zoomBackButton)
         self.zoomBackButton.setEnabled(True)
         self.zoomBackButton.clicked.connect(self.zoomBackEvent)
+        self.pyramidButton = QCheckBox("pyramid")
+        self.pyramidButton.setChecked(False)
+        self.pyramidButton.stateChanged.connect(self.pyramidEvent)
+        box.addWidget(self.pyramidButton)
+        self.bit16Button = QCheckBox("16bit")
+        self.bit16Button.setChecked(False)
+        self.bit16Button.stateChanged.connect(self.bit16Event)
+        box.addWidget(self.bit16Button)
+        self.latencyButton = QCheckBox("latency")
+        self.latencyButton.setChecked(False)
+        self.latencyButton.setToolTip("show p50/p95/p99 of each stage in the status")
+        box.addWidget(self.latencyButton)
+        self.latencyCsvButton = QPushButton("latencyCsv")
+        self.latencyCsvButton.setEnabled(True)
+        self.latencyCsvButton.clicked.connect(self.latencyCsvEvent)
+        box.addWidget(self.latencyCsvButton)
 
         wid = QWidget()
         wid.setLayout(box)
@@ -256,9 +293,36 @@ class NTNDA_Viewer(QWidget):
     def zoomEvent(self):
         self.display()
 
+    def pyramidEvent(self):
+        self.channelToImage.setPyramid(self.pyramidButton.isChecked())
+
+    def latencyCsvEvent(self):
+        filename = time.strftime("latency_%Y%m%d_%H%M%S.csv")
+        try:
+            self.latencyStats.writeCsv(filename)
+            self.statusText.setText("wrote " + filename)
+        except Exception as error:
+            self.statusText.setText(str(error))
+
+    def bit16Event(self):
+        if self.bit16Button.isChecked():
+            self.channelToImage.setDtypeImage(np.uint16)
+        else:
+            self.channelToImage.setDtypeImage(np.uint8)
+
     def scaleEvent(self):
         if self.autoScaleButton.isChecked():
             self.manualLimits = False
+            self.channelToImage.setApproximateLimits(False)
+            self.channelToImage.setPercentileLimits(None)
+        elif self.approxScaleButton.isChecked():
+            self.manualLimits = False
+            self.channelToImage.setApproximateLimits(True)
+            self.channelToImage.setPercentileLimits(None)
+        elif self.percentileScaleButton.isChecked():
+            self.manualLimits = False
+            self.channelToImage.setApproximateLimits(False)
+            self.channelToImage.setPercentileLimits((0.1, 99.9), smoothing=0.5)
         elif self.manualScaleButton.isChecked():
             self.manualLimits = True
         else:
@@ -310,18 +374,25 @@ class NTNDA_Viewer(QWidget):
         if type(self.channelDict) == type(None):
             return
         try:
-            if self.channelDict["nz"] == 3:
-                self.numpyImage.display(self.channelDict["image"])
+            levels = None
+            if self.numpyImage.getZoomDict()["isZoom"]:
+                # the pyramid is only created while zoomed
+                levels = self.channelToImage.getLevels()
+            if self.channelDict["nz"] == 3 or self.channelDict["dtypeImage"] == np.uint16:
+                # a Grayscale16 image does not use the color table
+                self.numpyImage.display(self.channelDict["image"], levels=levels)
             else:
                 self.numpyImage.display(
                     self.channelDict["image"],
                     colorTable=self.colorTable.getColorTable(),
+                    levels=levels,
                 )
         except Exception as error:
             self.statusText.setText(str(error))
 
     def closeEvent(self, event):
         self.isClosed = True
+        self.frameTimer.stop()
         if type(self.numpyImage)!=type(None) :
             self.numpyImage.setOkToClose()
             self.numpyImage.close()
@@ -351,6 +422,9 @@ class NTNDA_Viewer(QWidget):
                 imageSize=self.imageSize,
                 exceptionCallback=self.exceptionEvent
             )
+            self.numpyImage.setDisplayRate(self.displayRate)
+            self.numpyImage.setLatencyStats(self.latencyStats)
+            self.nDisplayed = 0
             self.numpyImage.setZoomCallback(self.zoomEvent)
             self.numpyImage.setMouseMoveCallback(self.numpyMouseMoveEvent)
         self.provider.start()
@@ -362,6 +436,8 @@ class NTNDA_Viewer(QWidget):
 
     def stop(self):
         self.provider.stop()
+        self.frameTimer.stop()
+        self.frame = None
         self.startButton.setEnabled(True)
         self.stopButton.setEnabled(False)
         self.channelNameLabel.setStyleSheet("background-color:gray")
@@ -370,6 +446,54 @@ class NTNDA_Viewer(QWidget):
         self.channel = None
         self.imageRateText.setText("0")
 
+    def zoomRoi(self, dimArray):
+        """ Returns the zoomed region in full size pixels for channelToImage or None """
+        previous = self.channelDict
+        if self.numpyImage == None or previous == None:
+            return None
+        sizes = [dim["size"] for dim in dimArray]
+        if previous["nx"] not in sizes or previous["ny"] not in sizes:
+            return None
+        zoomDict = self.numpyImage.getZoomDict()
+        if not zoomDict["isZoom"]:
+            return None
+        # one extra image pixel on each side so that NumpyImage can crop
+        compress = previous["compress"]
+        xstart = max(int(zoomDict["xoffset"]) - 1, 0) * compress
+        ystart = max(int(zoomDict["yoffset"]) - 1, 0) * compress
+        xend = (math.ceil(zoomDict["xoffset"] + zoomDict["nx"]) + 1) * compress
+        yend = (math.ceil(zoomDict["yoffset"] + zoomDict["ny"]) + 1) * compress
+        return (xstart, ystart, xend - xstart, yend - ystart)
+
+    def rowSelection(self, dimArray, roi=None, allRoiRows=False):
+        """ Returns the rowSelection for codecAD.decompress of a 2d image """
+        nx = dimArray[0]["size"]
+        ny = dimArray[1]["size"]
+        compress = self.channelToImage.getCompress(nx, ny, 1, self.imageSize)
+        start = 0
+        stop = ny
+        step = compress
+        previous = self.channelDict
+        if roi != None:
+            # rows of both the image and the region decimated by itself
+            roiCompress = self.channelToImage.getCompress(roi[2], roi[3], 1, self.imageSize)
+            start = min(roi[1], ny)
+            stop = min(roi[1] + roi[3], ny)
+            step = 1 if allRoiRows else math.gcd(compress, roiCompress)
+        elif (
+            self.numpyImage != None
+            and previous != None
+            and previous["nx"] == nx
+            and previous["ny"] == ny
+            and previous["compress"] == compress
+        ):
+            zoomDict = self.numpyImage.getZoomDict()
+            if zoomDict["isZoom"]:
+                yoffset = int(zoomDict["yoffset"])
+                start = yoffset * compress
+                stop = min((int(yoffset + zoomDict["ny"]) + 1) * compress, ny)
+        return (nx, start, stop, step)
+
     def callback(self, arg):
         if type(arg) == type(None):
             return
@@ -393,44 +517,138 @@ class NTNDA_Viewer(QWidget):
                 else:
                     self.statusText.setText("unknown callback error")
                     return
+        self.nImages = self.nImages + 1
+        receiveStamp = arg.get("receiveStamp")
+        if receiveStamp != None:
+            self.latencyStats.addSince("receive", receiveStamp)
+        try:
+            self.frame = CodecFrame(arg)
+        except Exception as error:
+            self.statusText.setText(str(error))
+            return
+        # frames that arrive before frameTimer fires replace self.frame
+        if not self.frameTimer.isActive():
+            # the first frame after an idle period is processed at once
+            self.processFrame()
+            self.frameTimer.start()
+
+    def frameTimerEvent(self):
+        if self.frame == None:
+            self.frameTimer.stop()
+            return
+        self.processFrame()
+
+    def processFrame(self):
+        frame = self.frame
+        self.frame = None
+        if frame == None or self.isClosed:
+            return
         try:
-            data = arg["value"]
-            dimArray = arg["dimension"]
+            dimArray = frame.getDimension()
             ndim = len(dimArray)
             if ndim != 2 and ndim != 3:
                 self.statusText.setText("ndim not 2 or 3")
                 return
-            compressed = arg["compressedSize"]
-            uncompressed = arg["uncompressedSize"]
-            codec = arg["codec"]
-            codecName = codec["name"]
-            codecNameLength = len(codecName)
-            if self.codecAD.decompress(data, codec, compressed, uncompressed):
-                self.codecIsNone = False
-                self.codecNameText.setText(self.codecAD.getCodecName())
-                data = self.codecAD.getData()
-                self.compressRatioText.setText(str(self.codecAD.getCompressRatio()))
-            else:
-                if not self.codecIsNone:
-                    self.codecIsNone = True
-                    self.codecNameText.setText(self.codecAD.getCodecName())
-                    self.compressRatioText.setText(str(self.codecAD.getCompressRatio()))
+            codecName = frame.getCodecName()
+            # Bayer and YUV are converted to rgb by channelToImage
+            colorMode = frame.getAttribute("ColorMode")
+            bayerPattern = frame.getAttribute("BayerPattern", 0)
+            converted = colorMode in (1, 5, 6, 7)
+            # only the zoomed region is processed by channelToImage
+            roi = self.zoomRoi(dimArray)
+            # the image is decimated so a codec can decode at reduced resolution.
+            # Every pixel of a Bayer or YUV image is needed for the conversion and
+            # the zoomed region and the pyramid need the full resolution.
+            scaleHint = 1
+            if not converted and roi == None and not self.channelToImage.getPyramid():
+                sizes = [dim["size"] for dim in dimArray]
+                nz = 1
+                if ndim == 3 and 3 in sizes:
+                    sizes.remove(3)
+                    nz = 3
+                scaleHint = self.channelToImage.getCompress(
+                    sizes[0], sizes[1], nz, self.imageSize
+                )
+            # unless autoscale reads every pixel only the displayed rows are needed
+            rowSelection = None
+            exactLimits = not (
+                self.manualLimits
+                or self.channelToImage.getApproximateLimits()
+                or self.channelToImage.getPercentileLimits()[0] != None
+            )
+            displayedOnly = (
+                not exactLimits or roi != None
+            ) and not self.channelToImage.getPyramid()
+            if codecName == "bslz4" and ndim == 2 and not converted and displayedOnly:
+                rowSelection = self.rowSelection(dimArray, roi, exactLimits)
+            start = self.latencyStats.stamp()
+            data = frame.decompress(
+                self.codecAD, scaleHint=scaleHint, rowSelection=rowSelection
+            )
+            self.latencyStats.addSince("decompress", start)
+            # the compress ratio is shown once a second and when the codec changes
+            codecIsNone = not frame.isCompressed()
+            codecName = self.codecAD.getCodecName()
+            if codecIsNone != self.codecIsNone or codecName != self.codecNameText.text():
+                self.codecIsNone = codecIsNone
+                self.codecNameText.setText(codecName)
+                self.showCodecStatistics()
         except Exception as error:
             self.statusText.setText(str(error))
             return
         try:
+            start = self.latencyStats.stamp()
             self.channelToImage.channelToImage(
-                data, dimArray, self.imageSize, manualLimits=self.manualLimits
+                data,
+                dimArray,
+                self.imageSize,
+                manualLimits=self.manualLimits,
+                scale=self.codecAD.getScale(),
+                roi=roi,
+                colorMode=colorMode,
+                bayerPattern=bayerPattern,
             )
+            self.latencyStats.addSince("channelToImage", start)
             self.channelDict = self.channelToImage.getChannelDict()
             self.followMouse.setChannelInfo(self.channelDict)
             self.display()
         except Exception as error:
             self.statusText.setText(str(error))
-        self.nImages = self.nImages + 1
         self.timenow = time.time()
         timediff = self.timenow - self.lasttime
         if timediff > 1:
-            self.imageRateText.setText(str(round(self.nImages / timediff)))
+            displayed = self.numpyImage.getDisplayStatistics()["displayed"]
+            self.imageRateText.setText(
+                "%d/%d"
+                % (
+                    round(self.nImages / timediff),
+                    round((displayed - self.nDisplayed) / timediff),
+                )
+            )
             self.lasttime = self.timenow
             self.nImages = 0
+            self.nDisplayed = displayed
+            if self.latencyButton.isChecked():
+                summary = self.latencyStats.getSummary()
+                self.statusText.setText(summary)
+                self.statusText.setToolTip(summary)
+            if not self.codecIsNone:
+                self.showCodecStatistics()
+
+    def showCodecStatistics(self):
+        if self.codecIsNone:
+            self.compressRatioText.setText("1")
+            self.compressRatioText.setToolTip("")
+            return
+        codecName = self.codecAD.getCodecName()
+        statistics = self.codecAD.getStatistics().getStatistics(codecName)
+        self.compressRatioText.setText("%.2f" % statistics["compressRatio"])
+        self.compressRatioText.setToolTip(
+            "%s decode %.2f ms mean, %d frames, %d failures"
+            % (
+                codecName,
+                statistics["meanSeconds"] * 1000.0,
+                statistics["frames"],
+                statistics["failures"],
+            )
+        )
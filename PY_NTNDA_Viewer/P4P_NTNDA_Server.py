@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+P4P_NTNDA_Server publishes a synthetic NTNDArray, optionally compressed by CodecAD.
+It can be used in place of an areaDetector IOC to test the viewers.
+
+    python P4P_NTNDA_Server.py channelName codec dtype size rate
+
+    channelName   default "PYTEST:Image"
+    codec         none, blosc, blosc2, lz4, bslz4, zstd, or jpeg. default none
+    dtype         numpy dtype of the image. default uint16. jpeg requires uint8
+    size          width and height of the image. default 1024
+    rate          images per second. default 10
+
+Copyright - See the COPYRIGHT that is included with this distribution.
+    NTNDA_Viewer is distributed subject to a Software License Agreement found
+    in file LICENSE that is included with this distribution.
+"""
+
+import sys, time
+import numpy as np
+from p4p.nt import NTNDArray
+from p4p.server import Server
+from p4p.server.thread import SharedPV
+
+sys.path.append("../codecAD/")
+from codecAD import CodecAD
+
+
+def createImage(size, dtype, frame):
+    x = np.arange(size, dtype=np.float32)
+    center = size * (0.5 + 0.3 * np.sin(frame / 20.0))
+    row = np.exp(-(((x - center) / (size / 10.0)) ** 2))
+    image = np.outer(row, row[::-1])
+    if np.dtype(dtype).kind == "f":
+        return image.astype(dtype)
+    high = min(np.iinfo(dtype).max, 60000)
+    return (image * high).astype(dtype)
+
+
+if __name__ == "__main__":
+    nargs = len(sys.argv)
+    channelName = sys.argv[1] if nargs >= 2 else "PYTEST:Image"
+    codecName = sys.argv[2] if nargs >= 3 else "none"
+    dtype = sys.argv[3] if nargs >= 4 else "uint16"
+    size = int(sys.argv[4]) if nargs >= 5 else 1024
+    rate = float(sys.argv[5]) if nargs >= 6 else 10.0
+    codecAD = CodecAD()
+    nt = NTNDArray()
+    pv = SharedPV(initial=nt.wrap(createImage(size, dtype, 0)))
+    frame = 0
+    with Server(providers=[{channelName: pv}]):
+        print("serving", channelName, "codec", codecName)
+        while True:
+            image = createImage(size, dtype, frame)
+            frame += 1
+            if codecName == "none":
+                pv.post(nt.wrap(image))
+            else:
+                result = codecAD.compress(image, codecName)
+                value = nt.wrap(result["value"])
+                value["dimension"] = [{"size": size}, {"size": size}]
+                value["codec.name"] = result["codec"]["name"]
+                value["codec.parameters"] = result["codec"]["parameters"]
+                value["compressedSize"] = result["compressedSize"]
+                value["uncompressedSize"] = result["uncompressedSize"]
+                pv.post(value)
+            time.sleep(1.0 / rate)
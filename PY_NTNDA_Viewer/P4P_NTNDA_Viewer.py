@@ -11,7 +11,7 @@ author Marty Kraimer
 
 from NTNDA_Viewer import NTNDA_Viewer
 from p4p.client.thread import Context
-import sys
+import sys, time
 from threading import Event
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QObject, pyqtSignal
@@ -27,6 +27,7 @@ class P4PProvider(QObject):
         self.firstCallback = True
         self.isClosed = True
         self.channelName = "13SIM1:Pva1:Image"
+        self.receiveStamp = None
 
     def setChannelName(self, channelName):
         self.channelName = channelName
@@ -41,7 +42,7 @@ class P4PProvider(QObject):
         self.subscription = self.ctxt.monitor(
             self.getChannelName(),
             self.p4pcallback,
-            request="field(value,dimension,codec,compressedSize,uncompressedSize)",
+            request="field(value,dimension,codec,compressedSize,uncompressedSize,attribute)",
             notify_disconnect=True,
         )
 
@@ -55,6 +56,7 @@ class P4PProvider(QObject):
     def p4pcallback(self, arg):
         if self.isClosed:
             return
+        self.receiveStamp = time.perf_counter_ns()
         self.struct = arg
         self.callbacksignal.emit()
         self.callbackDoneEvent.wait()
@@ -83,6 +85,8 @@ class P4PProvider(QObject):
             arg["codec"] = struct["codec"]
             arg["compressedSize"] = struct["compressedSize"]
             arg["uncompressedSize"] = struct["uncompressedSize"]
+            arg["attribute"] = struct["attribute"]
+            arg["receiveStamp"] = self.receiveStamp
             self.callback(arg)
             self.callbackDoneEvent.set()
             return
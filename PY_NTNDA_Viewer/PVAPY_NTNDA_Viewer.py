@@ -11,7 +11,7 @@ author Marty Kraimer
 
 from NTNDA_Viewer import NTNDA_Viewer
 from pvaccess import *
-import sys
+import sys, time
 from threading import Event
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QObject, pyqtSignal
@@ -55,7 +55,7 @@ class PVAPYProvider(QObject):
             self.channel.setConnectionCallback(self.pvapyconnectioncallback)
         self.channel.monitor(
             self.pvapymonitorcallback,
-            "field(value,dimension,codec,compressedSize,uncompressedSize)",
+            "field(value,dimension,codec,compressedSize,uncompressedSize,attribute)",
         )
 
     def stop(self):
@@ -85,6 +85,7 @@ class PVAPYProvider(QObject):
         self.connectdata = None
 
     def pvapymonitorcallback(self, arg):
+        self.receiveStamp = time.perf_counter_ns()
         if self.monitordata == None:
             self.monitordata = arg
             self.monitorCallbacksignal.emit()
@@ -127,6 +128,8 @@ class PVAPYProvider(QObject):
             arg["codec"] = cod
         arg["compressedSize"] = self.monitordata["compressedSize"]
         arg["uncompressedSize"] = self.monitordata["uncompressedSize"]
+        arg["attribute"] = self.monitordata["attribute"]
+        arg["receiveStamp"] = self.receiveStamp
         self.callViewerCallback(arg)
         self.monitordata = None
         self.callbackDoneEvent.set()
@@ -0,0 +1,172 @@
+"""
+tests for NTNDA_Viewer
+
+    python -m pytest -q test_NTNDA_Viewer.py
+"""
+
+import os
+import sys
+import time
+import threading
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+directory = os.path.dirname(os.path.abspath(__file__))
+for name in ("numpyImage", "codecAD", "channelToImageAD", "colorTable", "latencyStats"):
+    sys.path.append(os.path.join(directory, "..", name))
+sys.path.append(directory)
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QObject, pyqtSignal
+import codecAD
+from channelToImageAD import ChannelToImageAD
+from NTNDA_Viewer import NTNDA_Viewer
+
+
+class FastProvider(QObject):
+    # like P4PProvider the provider thread waits until the viewer callback returns
+    callbacksignal = pyqtSignal()
+
+    def __init__(self, args):
+        QObject.__init__(self)
+        self.callbacksignal.connect(self.mycallback)
+        self.callbackDoneEvent = threading.Event()
+        self.args = args
+        self.arg = None
+        self.thread = None
+
+    def getChannelName(self):
+        return "test"
+
+    def setChannelName(self, channelName):
+        pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.produce)
+        self.thread.start()
+
+    def stop(self):
+        pass
+
+    def produce(self):
+        for arg in self.args:
+            self.arg = arg
+            self.callbacksignal.emit()
+            self.callbackDoneEvent.wait()
+            self.callbackDoneEvent.clear()
+
+    def mycallback(self):
+        self.NTNDA_Viewer.callback(self.arg)
+        self.callbackDoneEvent.set()
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def testFastProducerSkipsFrames(app, monkeypatch):
+    # frames that arrive faster than displayRate replace each other before they are decoded
+    nx = 512
+    ny = 512
+    numFrames = 100
+    coder = codecAD.CodecAD()
+    args = list()
+    for i in range(numFrames):
+        image = np.full((ny, nx), i, dtype=np.uint16)
+        payload = coder.compress(image, "lz4")
+        payload["dimension"] = [{"size": nx}, {"size": ny}]
+        args.append(payload)
+    decompressed = list()
+    decompress = codecAD.CodecFrame.decompress
+
+    def countDecompress(self, *args, **kwargs):
+        decompressed.append(self)
+        return decompress(self, *args, **kwargs)
+
+    monkeypatch.setattr(codecAD.CodecFrame, "decompress", countDecompress)
+    provider = FastProvider(args)
+    viewer = NTNDA_Viewer(provider, "test")
+    try:
+        viewer.start()
+        timeout = time.time() + 20
+        while provider.thread.is_alive() and time.time() < timeout:
+            app.processEvents()
+        # let the frame timer process the last frame
+        end = time.time() + 0.5
+        while time.time() < end:
+            app.processEvents()
+        provider.thread.join(1)
+        assert not provider.thread.is_alive()
+        assert 1 <= len(decompressed) < numFrames / 2
+        # the newest frame is the one that is displayed
+        assert viewer.channelDict["channel"][0, 0] == numFrames - 1
+    finally:
+        viewer.stop()
+        viewer.close()
+
+
+class StubProvider:
+    def getChannelName(self):
+        return "test"
+
+    def setChannelName(self, channelName):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def processEvents(app, seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        app.processEvents()
+
+
+def testJpegFullResolutionWhileZoomed(app):
+    # a zoomed region and the pyramid are made from a full resolution decode
+    nx = 4096
+    ny = 4096
+    coder = codecAD.CodecAD()
+    if coder.getRegistry().getScaleBackend("jpeg") == None:
+        pytest.skip("no jpeg backend that can scale")
+    image = (np.add.outer(np.arange(ny) // 3, np.arange(nx) // 5) % 256).astype(np.uint8)
+    arg = coder.compress(image, "jpeg")
+    dimArray = [{"size": nx}, {"size": ny}]
+    arg["dimension"] = dimArray
+    viewer = NTNDA_Viewer(StubProvider(), "test")
+    try:
+        viewer.start()
+        viewer.callback(dict(arg))
+        processEvents(app, 0.1)
+        assert viewer.codecAD.getScale() > 1
+        viewer.zoomScale = 128
+        viewer.zoomInEvent()
+        viewer.callback(dict(arg))
+        processEvents(app, 0.1)
+        assert viewer.codecAD.getScale() == 1
+        channelDict = viewer.channelDict
+        assert channelDict["channelScale"] == 1
+        # the region level is the same as one made from a full resolution decode
+        roi = viewer.zoomRoi(dimArray)
+        assert roi != None
+        coder.decompress(
+            arg["value"], arg["codec"], arg["compressedSize"], arg["uncompressedSize"]
+        )
+        channelToImage = ChannelToImageAD()
+        channelToImage.channelToImage(coder.getData(), dimArray, viewer.imageSize, roi=roi)
+        expected = channelToImage.getChannelDict()["levels"][-1]
+        level = channelDict["levels"][-1]
+        assert level["scale"] == expected["scale"]
+        assert np.array_equal(level["image"], expected["image"])
+        viewer.resetEvent()
+        viewer.pyramidButton.setChecked(True)
+        viewer.callback(dict(arg))
+        processEvents(app, 0.1)
+        assert viewer.codecAD.getScale() == 1
+    finally:
+        viewer.stop()
+        viewer.close()
@@ -2,6 +2,8 @@
 
 import numpy as np
 import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ChannelToImageAD:
@@ -38,10 +40,65 @@ class ChannelToImageAD:
     latest date 2020.07.30
     """
 
-    def __init__(self, parent=None):
+    # dtypes that are scaled by a lookup table and the unsigned dtype used to index it
+    __lookupDtypes = {
+        np.dtype(np.uint8): np.uint8,
+        np.dtype(np.int8): np.uint8,
+        np.dtype(np.uint16): np.uint16,
+        np.dtype(np.int16): np.uint16,
+    }
+    __maxLookupTables = 8
+    # number of bytes for each min/max chunk. A chunk stays in cache for both reductions.
+    __limitsChunkBytes = 1 << 20
+    # histograms for dtypes without a lookup table use a subsample and fixed bins
+    __histogramSamples = 1 << 20
+    __histogramBins = 1024
+    # number of elements in a band of rows. Temporary arrays are at most one band.
+    __workElements = 1 << 16
+    # dtypes for image. A 2d image can be uint16 for a QImage.Format_Grayscale16
+    __dtypeImages = (np.dtype(np.uint8), np.dtype(np.uint16))
+    # NDColorMode_t and NDBayerPattern_t values defined by areaDetector
+    colorModes = ("Mono", "Bayer", "RGB1", "RGB2", "RGB3", "YUV444", "YUV422", "YUV411")
+    bayerPatterns = ("RGGB", "GBRG", "GRBG", "BGGR")
+    # (row,column) of red and of blue in each 2x2 cell for each bayerPattern
+    __bayerOffsets = (((0, 0), (1, 1)), ((1, 0), (0, 1)), ((0, 1), (1, 0)), ((1, 1), (0, 0)))
+    # IIDC byte order of a group of pixels and the number of pixels in a group
+    __yuvLayouts = {
+        5: {"u": 0, "y": [1], "v": 2, "pixels": 1},
+        6: {"u": 0, "y": [1, 3], "v": 2, "pixels": 2},
+        7: {"u": 0, "y": [1, 2, 4, 5], "v": 3, "pixels": 4},
+    }
+
+    def __init__(self, parent=None, numBuffers=2, numThreads=1):
+        """
+         Parameters
+        -----------
+            numBuffers : int
+                 number of image buffers that are reused.
+                 An image is only overwritten after it is no longer referenced,
+                 so 2 gives double buffering.
+            numThreads : int
+                 number of threads used for limits and scaling. See setNumThreads.
+        """
         self.__image = None
         self.__channelDict = self.channelDictCreate()
         self.__manualLimits = (0, 255)
+        self.__lookupTables = dict()
+        self.__approximateLimits = False
+        self.__percentiles = None
+        self.__smoothing = 0.0
+        self.__smoothedLimits = None
+        self.__histogram = None
+        self.__memoryLimit = None
+        self.__bufferPool = self.__BufferPool(numBuffers)
+        self.__works = list()
+        self.__pyramid = False
+        self.__pyramidArgs = None
+        self.__dtypeImage = np.dtype(np.uint8)
+        self.__nonFiniteIndex = None
+        self.__numThreads = 1
+        self.__executor = None
+        self.setNumThreads(numThreads)
 
     def channelDictCreate(self):
         """
@@ -56,6 +113,8 @@ class ChannelToImageAD:
             channelDict["image"]        None
             channelDict["dtypeImage"]   np.uint8
             channelDict["compress"]     1
+            channelDict["channelScale"] 1
+            channelDict["levels"]       None
         """
         return {
             "channel": None,
@@ -67,6 +126,8 @@ class ChannelToImageAD:
             "image": None,
             "dtypeImage": np.uint8,
             "compress": 1,
+            "channelScale": 1,
+            "levels": None,
         }
 
     def setManualLimits(self, manualLimits):
@@ -90,12 +151,271 @@ class ChannelToImageAD:
             channelDict["ny"]           ny for data from the callback
             channelDict["nz"]           nz (1,3) for (2d,3d) image
             channelDict["imagel"]       numpy 2d or 3d array for the image
-            channelDict["dtypeImage"]   dtype for image
+            channelDict["dtypeImage"]   dtype for image. See setDtypeImage
             channelDict["compress"]     how much channel data was compressed
+            channelDict["channelScale"] channel has width and height reduced by channelScale.
+                                        nx, ny, and compress refer to the full size data.
+            channelDict["levels"]       None or list of images with more resolution than image.
+                                        The pyramid levels are only present after getLevels.
+                                        See setPyramid, channelToImage, and NumpyImage.display.
 
         """
         return self.__channelDict
 
+    def setApproximateLimits(self, approximateLimits):
+        """
+         Parameters
+        -----------
+            approximateLimits : True or False
+                 If True autoscale limits are computed from the displayed pixels only.
+                 This is faster but can miss extreme values that are not displayed.
+        """
+        self.__approximateLimits = approximateLimits
+
+    def getApproximateLimits(self):
+        """
+        Returns
+        -------
+            approximateLimits : True or False
+                 are autoscale limits computed from the displayed pixels only?
+        """
+        return self.__approximateLimits
+
+    def setNumThreads(self, numThreads):
+        """
+         Parameters
+        -----------
+            numThreads : int
+                 number of threads used to compute limits and to scale the image.
+                 The image is split into bands of rows and each thread handles a group of bands.
+                 numpy releases the GIL for these operations, so the threads run in parallel.
+                 The result is identical for any number of threads.
+        """
+        numThreads = max(int(numThreads), 1)
+        if numThreads == self.__numThreads:
+            return
+        if self.__executor != None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+        self.__numThreads = numThreads
+
+    def getNumThreads(self):
+        """
+        Returns
+        -------
+            numThreads : int
+                 see setNumThreads
+        """
+        return self.__numThreads
+
+    def setPyramid(self, pyramid):
+        """
+         Parameters
+        -----------
+            pyramid : True or False
+                 If True each frame can also be scaled at full resolution and reduced by 2,4,...
+                 until the resolution of image is reached.
+                 getLevels returns these images so that NumpyImage can show
+                 zoomed regions with full detail without processing the frame again.
+                 They are only created when getLevels is called.
+        """
+        self.__pyramid = pyramid
+
+    def getPyramid(self):
+        """
+        Returns
+        -------
+            pyramid : True or False
+                 see setPyramid
+        """
+        return self.__pyramid
+
+    def setDtypeImage(self, dtypeImage):
+        """
+         Parameters
+        -----------
+            dtypeImage : np.uint8 or np.uint16
+                 dtype for a 2d image. A 3d image is always np.uint8.
+                 np.uint16 keeps the full dynamic range of 16 bit and float data
+                 and can be displayed as a QImage.Format_Grayscale16.
+                 A color table can only be used with np.uint8.
+        """
+        dtypeImage = np.dtype(dtypeImage)
+        if dtypeImage not in self.__dtypeImages:
+            raise Exception("dtypeImage must be uint8 or uint16")
+        self.__dtypeImage = dtypeImage
+
+    def getLevels(self):
+        """
+        Returns
+        -------
+            levels : list or None
+                 channelDict["levels"] for the last frame.
+                 If pyramid is True the first call after each frame creates the pyramid
+                 levels, each from the level before it, and adds them to channelDict["levels"].
+                 A frame that is never zoomed is not scaled at full resolution.
+        """
+        if self.__pyramidArgs != None:
+            levels = self.__createLevels(*self.__pyramidArgs)
+            self.__pyramidArgs = None
+            if self.__channelDict["levels"] != None:
+                levels.extend(self.__channelDict["levels"])
+            self.__channelDict["levels"] = levels
+        return self.__channelDict["levels"]
+
+    def getDtypeImage(self):
+        """
+        Returns
+        -------
+            dtypeImage : np.dtype
+                 see setDtypeImage
+        """
+        return self.__dtypeImage
+
+    def setNonFiniteIndex(self, nonFiniteIndex):
+        """
+         Parameters
+        -----------
+            nonFiniteIndex : int or None
+                 image value, i.e. color table index, for NaN and Inf pixels of float data.
+                 For a uint16 image it is multiplied by 257.
+                 None means NaN is 0 and Inf is scaled like the limits.
+                 Autoscale limits never include NaN or Inf.
+        """
+        if nonFiniteIndex != None and not (0 <= nonFiniteIndex <= 255):
+            raise Exception("nonFiniteIndex must be 0<=nonFiniteIndex<=255")
+        self.__nonFiniteIndex = nonFiniteIndex
+
+    def getNonFiniteIndex(self):
+        """
+        Returns
+        -------
+            nonFiniteIndex : int or None
+                 see setNonFiniteIndex
+        """
+        return self.__nonFiniteIndex
+
+    def setMemoryLimit(self, memoryLimit):
+        """
+         Parameters
+        -----------
+            memoryLimit : int or None
+                 maximum number of bytes for the buffers of channelToImage.
+                 These are the image buffers, the work buffers for scaling and limits,
+                 the lookup tables, the zoomed region, and the pyramid levels.
+                 If the image for imageSize would need more, a larger compress is used.
+                 The zoomed region and then the pyramid levels use what is left.
+                 The finest pyramid levels are left out until the rest fit.
+                 Bayer and YUV data are converted before this and are not included.
+                 None means no limit.
+        """
+        self.__memoryLimit = memoryLimit
+
+    def getMemoryLimit(self):
+        """
+        Returns
+        -------
+            memoryLimit : int or None
+                 see setMemoryLimit
+        """
+        return self.__memoryLimit
+
+    def getCompress(self, nx, ny, nz, imageSize):
+        """
+         Parameters
+        -----------
+            nx, ny, nz : int
+                 shape of the channel data
+            imageSize : int
+                 width and height for the generated image
+
+        Returns
+        -------
+            compress : int
+                 the decimation used by channelToImage. See setMemoryLimit
+        """
+        memoryLimit = None
+        if self.__memoryLimit != None:
+            memoryLimit = self.__memoryLimit - self.__getWorkBytes(nz)
+        return self.__findCompress(nx, ny, nz, imageSize, memoryLimit)
+
+    def __getItemsize(self, nz):
+        # bytes for each element of an image
+        if nz == 1:
+            return self.__dtypeImage.itemsize
+        return 1
+
+    def __getImageBytes(self, nx, ny, nz, compress):
+        # bytes for the buffers of an image decimated by compress
+        size = math.ceil(nx / compress) * math.ceil(ny / compress) * nz
+        return size * self.__getItemsize(nz) * self.__bufferPool.numBuffers
+
+    def __getWorkBytes(self, nz):
+        # each thread has a band of work, mask, and np.take indices and a chunk for limits.
+        # The lookup tables are cached and one more is created from float64 values.
+        numTables = 1 << 16
+        threadBytes = self.__workElements * (8 + 1 + 8) + 2 * self.__limitsChunkBytes
+        tableBytes = numTables * (self.__maxLookupTables * self.__getItemsize(nz) + 2 + 8)
+        return self.__numThreads * threadBytes + tableBytes
+
+    def __findCompress(self, nx, ny, nz, imageSize, memoryLimit):
+        # memoryLimit is the number of bytes for the image buffers or None
+        nmax = max(nx, ny)
+        compress = 1
+        if nmax > imageSize:
+            compress = math.ceil(float(nmax) / imageSize)
+        if memoryLimit != None:
+            while compress < nmax:
+                if self.__getImageBytes(nx, ny, nz, compress) <= memoryLimit:
+                    break
+                compress += 1
+        return compress
+
+    def setPercentileLimits(self, percentiles=None, smoothing=0.0):
+        """
+         Parameters
+        -----------
+            percentiles : tuple or None
+                 (low,high) percentiles, e.g. (0.1,99.9).
+                 If not None autoscale limits are these percentiles of the displayed pixels,
+                 so that a few hot pixels do not change the contrast.
+                 The percentiles are found from a histogram. See getHistogram.
+            smoothing : float
+                 0.0 <= smoothing < 1.0. The limits are smoothed across frames:
+                 limit = smoothing*previousLimit + (1.0-smoothing)*limitForFrame
+        """
+        if percentiles != None:
+            if not (0.0 <= percentiles[0] < percentiles[1] <= 100.0):
+                raise Exception("percentiles must be 0<=low<high<=100")
+        if not (0.0 <= smoothing < 1.0):
+            raise Exception("smoothing must be 0<=smoothing<1")
+        self.__percentiles = percentiles
+        self.__smoothing = smoothing
+        self.__smoothedLimits = None
+        self.__histogram = None
+
+    def getPercentileLimits(self):
+        """
+        Returns
+        -------
+            (percentiles, smoothing) : tuple
+                 see setPercentileLimits
+        """
+        return (self.__percentiles, self.__smoothing)
+
+    def getHistogram(self):
+        """
+        Returns
+        -------
+            histogram : tuple or None
+                 (counts,edges) for the last autoscale with percentile limits.
+                 counts[i] is the number of displayed pixels with edges[i] <= value < edges[i+1].
+                 8 and 16 bit integers have one bin for each value.
+                 Other dtypes have fixed bins computed from a subsample.
+                 None if percentile limits were not used.
+        """
+        return self.__histogram
+
     def getManualLimits(self):
         """
         Returns
@@ -106,30 +426,38 @@ class ChannelToImageAD:
         """
         return self.__manualLimits
 
-    def __reshapeChannel(self, data, dimArray):
+    def __reshapeChannel(self, data, dimArray, scale=1):
+        # nx and ny are the sizes from dimArray.
+        # image has nx and ny reduced by scale
         nz = 1
         ndim = len(dimArray)
         if ndim == 2:
             nx = dimArray[0]["size"]
             ny = dimArray[1]["size"]
-            image = np.reshape(data, (ny, nx))
+            image = np.reshape(data, (math.ceil(ny / scale), math.ceil(nx / scale)))
         elif ndim == 3:
             if dimArray[0]["size"] == 3:
                 nz = dimArray[0]["size"]
                 nx = dimArray[1]["size"]
                 ny = dimArray[2]["size"]
-                image = np.reshape(data, (ny, nx, nz))
+                image = np.reshape(
+                    data, (math.ceil(ny / scale), math.ceil(nx / scale), nz)
+                )
             elif dimArray[1]["size"] == 3:
                 nz = dimArray[1]["size"]
                 nx = dimArray[0]["size"]
                 ny = dimArray[2]["size"]
-                image = np.reshape(data, (ny, nz, nx))
+                image = np.reshape(
+                    data, (math.ceil(ny / scale), nz, math.ceil(nx / scale))
+                )
                 image = np.swapaxes(image, 2, 1)
             elif dimArray[2]["size"] == 3:
                 nz = dimArray[2]["size"]
                 nx = dimArray[0]["size"]
                 ny = dimArray[1]["size"]
-                image = np.reshape(data, (nz, ny, nx))
+                image = np.reshape(
+                    data, (nz, math.ceil(ny / scale), math.ceil(nx / scale))
+                )
                 image = np.swapaxes(image, 0, 2)
                 image = np.swapaxes(image, 0, 1)
             else:
@@ -167,7 +495,456 @@ class ChannelToImageAD:
             image = np.swapaxes(image, 0, 1)
         return image
 
-    def channelToImage(self, data, dimArray, imageSize, manualLimits=False):
+    def __getWorkType(self, dtype):
+        # float type that holds every value of dtype without a large loss of precision
+        if dtype.itemsize <= 2 or dtype == np.float32:
+            return np.float32
+        return np.float64
+
+    def __binBayer(self, mosaic, bayerPattern):
+        # each 2x2 cell becomes one rgb pixel. green is the mean of the two green pixels.
+        red, blue = self.__bayerOffsets[bayerPattern]
+        ny = mosaic.shape[0] // 2 * 2
+        nx = mosaic.shape[1] // 2 * 2
+        rgb = self.__bufferPool.getBuffer((ny // 2, nx // 2, 3), mosaic.dtype)
+        rgb[:, :, 0] = mosaic[red[0] : ny : 2, red[1] : nx : 2]
+        rgb[:, :, 2] = mosaic[blue[0] : ny : 2, blue[1] : nx : 2]
+        green = mosaic[red[0] : ny : 2, blue[1] : nx : 2].astype(
+            self.__getWorkType(mosaic.dtype)
+        )
+        green += mosaic[blue[0] : ny : 2, red[1] : nx : 2]
+        green *= 0.5
+        if mosaic.dtype.kind in "iu":
+            np.rint(green, out=green)
+        np.copyto(rgb[:, :, 1], green, casting="unsafe")
+        return rgb
+
+    def __demosaicBayer(self, mosaic, bayerPattern):
+        # bilinear interpolation.
+        # Each of the four pixels of a 2x2 cell is handled for the whole image at once.
+        # A missing color is the mean of the nearest pixels that measured it.
+        ny = mosaic.shape[0]
+        nx = mosaic.shape[1]
+        red, blue = self.__bayerOffsets[bayerPattern]
+        workType = self.__getWorkType(mosaic.dtype)
+        # reflect keeps the bayer pattern of the border pixels
+        padded = np.pad(mosaic, 1, mode="reflect")
+        rgb = self.__bufferPool.getBuffer((ny, nx, 3), mosaic.dtype)
+        cross = ((-1, 0), (1, 0), (0, -1), (0, 1))
+        diagonal = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        for py in range(2):
+            for px in range(2):
+                numy = len(range(py, ny, 2))
+                numx = len(range(px, nx, 2))
+                if numy == 0 or numx == 0:
+                    continue
+
+                def neighbor(dy, dx):
+                    y = py + 1 + dy
+                    x = px + 1 + dx
+                    return padded[y : y + 2 * numy - 1 : 2, x : x + 2 * numx - 1 : 2]
+
+                def mean(offsets):
+                    total = neighbor(*offsets[0]).astype(workType)
+                    for offset in offsets[1:]:
+                        total += neighbor(*offset)
+                    total *= 1.0 / len(offsets)
+                    if mosaic.dtype.kind in "iu":
+                        np.rint(total, out=total)
+                    return total
+
+                out = rgb[py::2, px::2]
+                if (py, px) == red or (py, px) == blue:
+                    measured = 0 if (py, px) == red else 2
+                    out[:, :, measured] = neighbor(0, 0)
+                    np.copyto(out[:, :, 1], mean(cross), casting="unsafe")
+                    np.copyto(out[:, :, 2 - measured], mean(diagonal), casting="unsafe")
+                else:
+                    out[:, :, 1] = neighbor(0, 0)
+                    # red is in the same row or in the same column as this green
+                    rows = ((0, -1), (0, 1))
+                    columns = ((-1, 0), (1, 0))
+                    redOffsets = rows if red[0] == py else columns
+                    blueOffsets = columns if red[0] == py else rows
+                    np.copyto(out[:, :, 0], mean(redOffsets), casting="unsafe")
+                    np.copyto(out[:, :, 2], mean(blueOffsets), casting="unsafe")
+        return rgb
+
+    def __convertBayer(self, data, dimArray, imageSize, bayerPattern, scale):
+        # Returns (image,nx,ny,nz,scale). image has scale 2 if it is decimated by an even factor.
+        if len(dimArray) != 2:
+            raise Exception("Bayer data must be 2d")
+        if scale != 1:
+            raise Exception("Bayer data must be decoded at full resolution")
+        if not (0 <= bayerPattern < len(self.bayerPatterns)):
+            raise Exception("illegal bayerPattern")
+        nx = dimArray[0]["size"]
+        ny = dimArray[1]["size"]
+        mosaic = np.reshape(data, (ny, nx))
+        # binning is exact only if the image is decimated by a multiple of 2
+        if self.getCompress(nx, ny, 3, imageSize) % 2 == 0:
+            return (self.__binBayer(mosaic, bayerPattern), nx, ny, 3, 2)
+        return (self.__demosaicBayer(mosaic, bayerPattern), nx, ny, 3, 1)
+
+    def __convertYUV(self, data, dimArray, colorMode, scale):
+        # Returns (image,nx,ny,nz,scale). ITU-R BT.601 conversion to rgb
+        if data.dtype != np.uint8:
+            raise Exception("YUV data must be uint8")
+        if scale != 1:
+            raise Exception("YUV data must be decoded at full resolution")
+        layout = self.__yuvLayouts[colorMode]
+        pixels = layout["pixels"]
+        groupBytes = len(layout["y"]) + 2
+        if colorMode == 5:
+            if len(dimArray) != 3 or dimArray[0]["size"] != 3:
+                raise Exception("YUV444 dimension must be (3,nx,ny)")
+            nx = dimArray[1]["size"]
+            ny = dimArray[2]["size"]
+        else:
+            if len(dimArray) != 2:
+                raise Exception("YUV422 and YUV411 must be 2d")
+            nx = dimArray[0]["size"]
+            ny = dimArray[1]["size"]
+            if nx * ny == data.size:
+                # the first dimension is bytes instead of pixels
+                nx = nx * pixels // groupBytes
+        if nx % pixels != 0:
+            raise Exception("nx must be a multiple of " + str(pixels))
+        groups = np.reshape(data, (ny, nx // pixels, groupBytes))
+        workType = np.float32
+        y = groups[:, :, layout["y"]].astype(workType)
+        u = groups[:, :, layout["u"] : layout["u"] + 1].astype(workType)
+        v = groups[:, :, layout["v"] : layout["v"] + 1].astype(workType)
+        u -= 128.0
+        v -= 128.0
+        rgb = self.__bufferPool.getBuffer((ny, nx, 3), np.uint8)
+        out = rgb.reshape((ny, nx // pixels, pixels, 3))
+        work = np.empty(y.shape, dtype=workType)
+        coefficients = ((0.0, 1.402), (-0.344136, -0.714136), (1.772, 0.0))
+        for index, (cu, cv) in enumerate(coefficients):
+            np.copyto(work, y)
+            if cu != 0.0:
+                work += cu * u
+            if cv != 0.0:
+                work += cv * v
+            np.clip(work, 0.0, 255.0, out=work)
+            np.rint(work, out=work)
+            np.copyto(out[:, :, :, index], work, casting="unsafe")
+        return (rgb, nx, ny, 3, 1)
+
+    def __getLookupTable(self, dtype, displayMin, displayMax, dtypeImage):
+        # table[i] is the dtypeImage value for the element with bit pattern i.
+        # It is created by np.interp so it gives exactly the same result as __interpImage.
+        key = (dtype, displayMin, displayMax, dtypeImage)
+        table = self.__lookupTables.get(key)
+        if table is None:
+            indexType = self.__lookupDtypes[dtype]
+            values = np.arange(np.iinfo(indexType).max + 1, dtype=indexType).view(dtype)
+            table = self.__interpImage(values, displayMin, displayMax, dtypeImage)
+            if len(self.__lookupTables) >= self.__maxLookupTables:
+                self.__lookupTables = dict()
+            self.__lookupTables[key] = table
+        return table
+
+    def __interpImage(self, image, displayMin, displayMax, dtypeImage):
+        xp = (displayMin, displayMax)
+        fp = (0.0, float(np.iinfo(dtypeImage).max))
+        return (np.interp(image, xp, fp)).astype(dtypeImage)
+
+    def __forGroups(self, num, function):
+        # calls function(first,end,group) for contiguous groups of range(num).
+        # Each group is run by a separate thread. Returns the list of results.
+        numGroups = min(self.__numThreads, num)
+        if numGroups <= 1:
+            return [function(0, num, 0)]
+        if self.__executor == None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__numThreads)
+        bounds = [int(i * num / numGroups) for i in range(numGroups + 1)]
+        futures = [
+            self.__executor.submit(function, bounds[i], bounds[i + 1], i)
+            for i in range(numGroups)
+        ]
+        return [future.result() for future in futures]
+
+    def __getLimits(self, data):
+        # min and max in one pass over memory.
+        # A contiguous array is split into chunks of elements, otherwise into chunks of rows.
+        if data.flags.c_contiguous:
+            data = data.reshape(-1)
+            size = max(self.__limitsChunkBytes // data.itemsize, 1)
+        else:
+            rowBytes = max(int(data.nbytes / max(data.shape[0], 1)), 1)
+            size = max(self.__limitsChunkBytes // rowBytes, 1)
+        numChunks = max(math.ceil(data.shape[0] / size), 1)
+        isFloat = data.dtype.kind == "f"
+
+        def getChunkLimits(first, end, group):
+            mins = list()
+            maxs = list()
+            for i in range(first, end):
+                chunk = data[i * size : (i + 1) * size]
+                if not isFloat:
+                    mins.append(np.min(chunk))
+                    maxs.append(np.max(chunk))
+                    continue
+                # fmin and fmax ignore NaN. Inf is rare so it is removed only when found.
+                low = np.fmin.reduce(chunk, axis=None)
+                high = np.fmax.reduce(chunk, axis=None)
+                if np.isinf(low) or np.isinf(high):
+                    chunk = chunk[np.isfinite(chunk)]
+                    if chunk.size == 0:
+                        continue
+                    low = np.min(chunk)
+                    high = np.max(chunk)
+                if not np.isnan(low):
+                    mins.append(low)
+                    maxs.append(high)
+            return (mins, maxs)
+
+        mins = list()
+        maxs = list()
+        for result in self.__forGroups(numChunks, getChunkLimits):
+            mins += result[0]
+            maxs += result[1]
+        if len(mins) == 0:
+            # no finite values
+            return (data.dtype.type(0), data.dtype.type(0))
+        return (np.min(mins), np.max(maxs))
+
+    def __createHistogram(self, image):
+        dtype = image.dtype
+        if dtype in self.__lookupDtypes:
+            indexType = self.__lookupDtypes[dtype]
+            num = np.iinfo(indexType).max + 1
+            counts = np.bincount(image.view(indexType).reshape(-1), minlength=num)
+            info = np.iinfo(dtype)
+            if info.min < 0:
+                # bit pattern order to value order
+                counts = np.roll(counts, -info.min)
+            edges = np.arange(info.min, info.max + 2)
+            return (counts, edges)
+        samples = image.reshape(-1)
+        if samples.size > self.__histogramSamples:
+            samples = samples[:: math.ceil(samples.size / self.__histogramSamples)]
+        if dtype.kind == "f":
+            samples = samples[np.isfinite(samples)]
+        if samples.size == 0:
+            return None
+        return np.histogram(samples, bins=self.__histogramBins)
+
+    def __getPercentileLimits(self, image):
+        histogram = self.__createHistogram(image)
+        self.__histogram = histogram
+        if histogram is None:
+            return self.__getLimits(image)
+        counts, edges = histogram
+        cumulative = np.cumsum(counts)
+        total = cumulative[-1]
+        last = len(counts) - 1
+        low = np.searchsorted(cumulative, total * self.__percentiles[0] / 100.0, "right")
+        high = np.searchsorted(cumulative, total * self.__percentiles[1] / 100.0, "left")
+        low = min(low, last)
+        high = min(high, last)
+        displayMin = edges[low]
+        if image.dtype in self.__lookupDtypes:
+            displayMax = edges[high]
+        else:
+            displayMax = edges[high + 1]
+        limits = (displayMin, displayMax)
+        if self.__smoothedLimits != None and self.__smoothedLimits[0] == image.dtype:
+            previous = self.__smoothedLimits[1]
+            limits = tuple(
+                self.__smoothing * previous[i] + (1.0 - self.__smoothing) * limits[i]
+                for i in range(2)
+            )
+            if image.dtype.kind in "iu":
+                limits = (round(limits[0]), round(limits[1]))
+        self.__smoothedLimits = (image.dtype, limits)
+        return limits
+
+    def __getBandRows(self, image):
+        # number of rows in a band of about __workElements elements
+        rowElements = max(int(image.size / max(image.shape[0], 1)), 1)
+        return max(self.__workElements // rowElements, 1)
+
+    def __getNonFinite(self, band, mask, dtypeImage):
+        # mask is set where band is NaN, or also Inf if nonFiniteIndex is set.
+        # Returns the image value for these pixels or None if there are none.
+        if self.__nonFiniteIndex == None:
+            np.isnan(band, out=mask)
+            value = 0
+        else:
+            np.isfinite(band, out=mask)
+            np.logical_not(mask, out=mask)
+            value = self.__nonFiniteIndex
+            if dtypeImage == np.uint16:
+                value = value * 257
+        if not mask.any():
+            return None
+        return value
+
+    def __scaleRows(self, image, out, displayMin, displayMax):
+        # image is scaled in bands of rows so that only a small work buffer is needed.
+        # float32 data is scaled with float32 arithmetic.
+        displayMin = float(displayMin)
+        displayMax = float(displayMax)
+        high = np.iinfo(out.dtype).max
+        isFloat = image.dtype.kind == "f"
+        if displayMax <= displayMin:
+            np.greater_equal(image, displayMax, out=out)
+            np.multiply(out, high, out=out)
+            if isFloat:
+                mask = np.empty(image.shape, dtype=bool)
+                value = self.__getNonFinite(image, mask, out.dtype)
+                if value != None:
+                    np.copyto(out, value, where=mask)
+            return
+        workType = np.float32 if image.dtype == np.float32 else np.float64
+        rows = self.__getBandRows(image)
+        rowElements = max(int(image.size / max(image.shape[0], 1)), 1)
+        # each group of bands has its own work and mask buffers
+        while len(self.__works) < self.__numThreads:
+            self.__works.append(None)
+        for group in range(self.__numThreads):
+            work = self.__works[group]
+            if work is None or work[0].size < rows * rowElements or work[0].dtype != workType:
+                self.__works[group] = (
+                    np.empty(rows * rowElements, dtype=workType),
+                    np.empty(rows * rowElements, dtype=bool),
+                )
+        works = self.__works
+
+        def scaleBands(firstBand, endBand, group):
+            for first in range(firstBand * rows, min(endBand * rows, image.shape[0]), rows):
+                band = image[first : first + rows]
+                work = works[group][0][: band.size].reshape(band.shape)
+                np.clip(band, displayMin, displayMax, out=work)
+                np.subtract(work, displayMin, out=work)
+                np.divide(work, displayMax - displayMin, out=work)
+                np.multiply(work, float(high), out=work)
+                value = None
+                if isFloat:
+                    mask = works[group][1][: band.size].reshape(band.shape)
+                    value = self.__getNonFinite(band, mask, out.dtype)
+                    if value != None:
+                        # NaN can not be cast
+                        np.copyto(work, 0.0, where=mask)
+                np.copyto(out[first : first + rows], work, casting="unsafe")
+                if value != None:
+                    np.copyto(out[first : first + rows], value, where=mask)
+
+        self.__forGroups(math.ceil(image.shape[0] / rows), scaleBands)
+
+    def __scaleImage(self, image, displayMin, displayMax, dtypeImage):
+        # the result is written into a reused buffer
+        out = self.__bufferPool.getBuffer(image.shape, dtypeImage)
+        dtype = image.dtype
+        if dtype in self.__lookupDtypes:
+            # 8 and 16 bit integers are scaled by a gather from a lookup table.
+            # np.take converts the indices to intp so it is also done in bands of rows.
+            table = self.__getLookupTable(dtype, displayMin, displayMax, dtypeImage)
+            indices = image.view(self.__lookupDtypes[dtype])
+            rows = self.__getBandRows(image)
+
+            def takeBands(firstBand, endBand, group):
+                for first in range(firstBand * rows, min(endBand * rows, image.shape[0]), rows):
+                    np.take(
+                        table,
+                        indices[first : first + rows],
+                        out=out[first : first + rows],
+                        mode="clip",
+                    )
+
+            self.__forGroups(math.ceil(image.shape[0] / rows), takeBands)
+        else:
+            self.__scaleRows(image, out, displayMin, displayMax)
+        return out
+
+    def __reduceLevel(self, image):
+        # mean of each 2x2 block, computed in bands of rows
+        ny = image.shape[0] // 2
+        nx = image.shape[1] // 2
+        sumType = np.uint16 if image.dtype == np.uint8 else np.uint32
+        level = self.__bufferPool.getBuffer((ny, nx) + image.shape[2:], image.dtype)
+        rows = self.__getBandRows(level)
+        for first in range(0, ny, rows):
+            end = min(first + rows, ny)
+            band = image[2 * first : 2 * end]
+            total = band[0::2, 0 : 2 * nx : 2].astype(sumType)
+            total += band[1::2, 0 : 2 * nx : 2]
+            total += band[0::2, 1 : 2 * nx : 2]
+            total += band[1::2, 1 : 2 * nx : 2]
+            total += 2
+            total >>= 2
+            np.copyto(level[first:end], total, casting="unsafe")
+        return level
+
+    def __getLevelBytes(self, channel, compress, step):
+        # bytes for the levels of channel[::step,::step] with scale compress/step,...
+        ny = math.ceil(channel.shape[0] / step)
+        nx = math.ceil(channel.shape[1] / step)
+        nz = 1 if channel.ndim == 2 else channel.shape[2]
+        size = 0
+        levelScale = float(compress) / step
+        while levelScale > 1.0:
+            size += nx * ny * nz
+            levelScale = levelScale / 2.0
+            nx = nx // 2
+            ny = ny // 2
+        return size * self.__getItemsize(nz) * self.__bufferPool.numBuffers
+
+    def __createLevels(
+        self, channel, compress, interp, displayMin, displayMax, dtypeImage, memoryLimit
+    ):
+        # level k has the resolution of channel reduced by 2**k.
+        # The finest levels are left out until the others fit in memoryLimit.
+        step = 1
+        while memoryLimit != None and compress / step > 1.0:
+            if self.__getLevelBytes(channel, compress, step) <= memoryLimit:
+                break
+            step = step * 2
+        if compress / step <= 1.0:
+            return list()
+        if step > 1:
+            channel = channel[::step, ::step]
+        if interp:
+            level = self.__scaleImage(channel, displayMin, displayMax, dtypeImage)
+        else:
+            level = channel
+        levels = list()
+        levelScale = float(compress) / step
+        while levelScale > 1.0:
+            levels.append({"image": level, "scale": levelScale, "xoffset": 0, "yoffset": 0})
+            levelScale = levelScale / 2.0
+            if levelScale <= 1.0:
+                break
+            level = self.__reduceLevel(level)
+        return levels
+
+    def __getRoiRegion(self, channel, roi, scale):
+        # roi is (xoffset,yoffset,nx,ny) in full size pixels.
+        # Returns (xstart,xend,ystart,yend) in channel pixels or None if roi is empty.
+        ny = channel.shape[0]
+        nx = channel.shape[1]
+        xstart = min(max(int(roi[0] // scale), 0), nx)
+        ystart = min(max(int(roi[1] // scale), 0), ny)
+        xend = min(math.ceil((roi[0] + roi[2]) / scale), nx)
+        yend = min(math.ceil((roi[1] + roi[3]) / scale), ny)
+        if xend <= xstart or yend <= ystart:
+            return None
+        return (xstart, xend, ystart, yend)
+
+    def channelToImage(
+        self,
+        data,
+        dimArray,
+        imageSize,
+        manualLimits=False,
+        scale=1,
+        roi=None,
+        colorMode=None,
+        bayerPattern=0,
+    ):
         """
          Parameters
         -----------
@@ -175,9 +952,33 @@ class ChannelToImageAD:
             dimArray           : dimension from callback
             imageSize          : width and height for the generated image
             manualLimits       : (False,True) means client (does not,does) set limits
+                                 If False see setPercentileLimits and setApproximateLimits
+            scale              : data was decoded with width and height reduced by scale.
+                                 See CodecAD.getScale. The data is decimated by the
+                                 remaining compress, so if scale divides getCompress
+                                 for the full size the image is the same size as for scale 1.
+            roi                : None or (xoffset,yoffset,nx,ny) in full size pixels.
+                                 This is the region that is zoomed by NumpyImage.
+                                 The region is also decimated for imageSize by itself and
+                                 appended to channelDict["levels"].
+                                 Autoscale limits are computed from the region only.
+            colorMode          : None or the ColorMode attribute. See colorModes.
+                                 None, Mono, and RGB1,2,3 are found from dimArray.
+                                 Bayer is converted to rgb by bilinear interpolation or,
+                                 if the image is decimated by a multiple of 2, by binning each
+                                 2x2 cell. YUV444, YUV422, and YUV411 are converted to rgb.
+            bayerPattern       : the BayerPattern attribute. See bayerPatterns.
         """
         dtype = data.dtype
-        reshape = self.__reshapeChannel(data, dimArray)
+        if colorMode == 1:
+            reshape = self.__convertBayer(data, dimArray, imageSize, bayerPattern, scale)
+            scale = reshape[4]
+            data = reshape[0]
+        elif colorMode in self.__yuvLayouts:
+            reshape = self.__convertYUV(data, dimArray, colorMode, scale)
+            data = reshape[0]
+        else:
+            reshape = self.__reshapeChannel(data, dimArray, scale)
         image = reshape[0]
         self.__channelDict["channel"] = image
         nx = reshape[1]
@@ -187,32 +988,128 @@ class ChannelToImageAD:
         self.__channelDict["ny"] = ny
         self.__channelDict["nz"] = nz
         self.__channelDict["dtypeChannel"] = dtype
-        if manualLimits:
-            displayMin = self.__manualLimits[0]
-            displayMax = self.__manualLimits[1]
-        else:
-            displayMin = np.min(data)
-            displayMax = np.max(data)
-        interp = True
-        if dtype == np.uint8 :
-            if displayMin<=2 and displayMax>=250 : interp = False
-        if interp:
-            xp = (displayMin, displayMax)
-            fp = (0.0, 255.0)
-            image = (np.interp(image, xp, fp)).astype(np.uint8)
 #        if nx != ny:
 #            image = self.__expandChannel(image)
-        nmax = 0
-        if nx > nmax:
-            nmax = nx
-        if ny > nmax:
-            nmax = ny
-        compress = 1
-        if nmax > imageSize:
-            compress = math.ceil(float(nmax) / imageSize)
+        # decimate first so that only displayed pixels are scaled.
+        # compress is found from the full size so that data decoded with a scale
+        # is decimated as much in total as data decoded at full resolution.
+        compress = math.ceil(self.getCompress(nx, ny, nz, imageSize) / scale)
+        if compress > 1:
             if nz == 1:
                 image = image[::compress, ::compress]
             else:
                 image = image[::compress, ::compress, ::]
+        # what the image does not use is left for the zoomed region and the pyramid
+        memoryLimit = None
+        if self.__memoryLimit != None:
+            shape = self.__channelDict["channel"].shape
+            memoryLimit = (
+                self.__memoryLimit
+                - self.__getWorkBytes(nz)
+                - self.__getImageBytes(shape[1], shape[0], nz, compress)
+            )
+        # only the region is read for the limits and scaled at its own decimation
+        region = None
+        roiImage = None
+        if roi != None:
+            region = self.__getRoiRegion(self.__channelDict["channel"], roi, scale)
+        if region != None:
+            xstart, xend, ystart, yend = region
+            roiChannel = self.__channelDict["channel"][ystart:yend, xstart:xend]
+            roiCompress = self.__findCompress(
+                xend - xstart, yend - ystart, nz, imageSize, memoryLimit
+            )
+            roiImage = roiChannel[::roiCompress, ::roiCompress]
+        limitsImage = image if roiImage is None else roiImage
+        if manualLimits:
+            displayMin = self.__manualLimits[0]
+            displayMax = self.__manualLimits[1]
+        elif self.__percentiles != None:
+            displayMin, displayMax = self.__getPercentileLimits(limitsImage)
+        elif self.__approximateLimits:
+            displayMin, displayMax = self.__getLimits(limitsImage)
+        elif region != None:
+            displayMin, displayMax = self.__getLimits(roiChannel)
+        else:
+            displayMin, displayMax = self.__getLimits(data)
+        dtypeImage = self.__dtypeImage if nz == 1 else np.dtype(np.uint8)
+        interp = True
+        if dtype == dtypeImage:
+            # limits close to the full range are displayed without scaling
+            high = np.iinfo(dtype).max
+            if displayMin <= high * 2 // 255 and displayMax >= high * 250 // 255:
+                interp = False
+        levels = None
+        if roiImage is not None and roiCompress < compress:
+            if memoryLimit != None:
+                memoryLimit -= self.__getImageBytes(
+                    xend - xstart, yend - ystart, nz, roiCompress
+                )
+            if interp:
+                roiImage = self.__scaleImage(roiImage, displayMin, displayMax, dtypeImage)
+            if levels == None:
+                levels = list()
+            levels.append(
+                {
+                    "image": roiImage,
+                    "scale": float(compress) / roiCompress,
+                    "xoffset": float(xstart) / compress,
+                    "yoffset": float(ystart) / compress,
+                }
+            )
+        # the pyramid is created by getLevels when a zoom needs it
+        self.__pyramidArgs = None
+        if self.__pyramid and compress > 1:
+            self.__pyramidArgs = (
+                self.__channelDict["channel"],
+                compress,
+                interp,
+                displayMin,
+                displayMax,
+                dtypeImage,
+                memoryLimit,
+            )
+        if interp:
+            image = self.__scaleImage(image, displayMin, displayMax, dtypeImage)
+        elif not image.flags.c_contiguous:
+            # a decimated or planar view is copied once so that the image can be used directly
+            out = self.__bufferPool.getBuffer(image.shape, image.dtype)
+            np.copyto(out, image)
+            image = out
         self.__channelDict["image"] = image
-        self.__channelDict["compress"] = compress
+        self.__channelDict["dtypeImage"] = dtypeImage
+        self.__channelDict["levels"] = levels
+        self.__channelDict["compress"] = compress * scale
+        self.__channelDict["channelScale"] = scale
+
+    class __BufferPool:
+        # the pyramid levels need buffers with several shapes for each frame
+        maxKeys = 16
+
+        def __init__(self, numBuffers):
+            self.numBuffers = max(int(numBuffers), 1)
+            self.pools = dict()
+
+        def getBuffer(self, shape, dtype):
+            key = (shape, np.dtype(dtype))
+            pool = self.pools.get(key)
+            if pool is None:
+                # buffers still referenced by a client are kept alive by the client
+                if len(self.pools) >= self.maxKeys:
+                    self.pools = dict()
+                pool = {"buffers": list(), "next": 0}
+                self.pools[key] = pool
+            buffers = pool["buffers"]
+            num = len(buffers)
+            for i in range(num):
+                index = (pool["next"] + i) % num
+                buffer = buffers[index]
+                # references are buffers, buffer, and the getrefcount argument
+                if sys.getrefcount(buffer) <= 3:
+                    pool["next"] = (index + 1) % num
+                    return buffer
+            buffer = np.empty(shape, dtype=dtype)
+            if num < self.numBuffers:
+                buffers.append(buffer)
+                pool["next"] = 0
+            return buffer
@@ -0,0 +1,109 @@
+"""
+tests for ChannelToImageAD
+
+    python -m pytest -q test_channelToImageAD.py
+"""
+
+import os
+import sys
+import tracemalloc
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../codecAD/"))
+from channelToImageAD import ChannelToImageAD
+from codecAD import CodecAD
+
+
+def createDimArray(nx, ny):
+    return [{"size": nx}, {"size": ny}]
+
+
+@pytest.mark.parametrize("imageSize", [500, 600, 800, 1000])
+def testJpegScaleKeepsImageSize(imageSize):
+    # a jpeg decoded at reduced resolution must give the same image as a full decode
+    codecAD = CodecAD()
+    if codecAD.getRegistry().getScaleBackend("jpeg") == None:
+        pytest.skip("no jpeg backend that can scale")
+    nx = 4000
+    ny = 3000
+    image = np.random.default_rng(0).integers(0, 256, (ny, nx), dtype=np.uint8)
+    payload = codecAD.compress(image, "jpeg")
+    dimArray = createDimArray(nx, ny)
+    args = (
+        payload["value"],
+        payload["codec"],
+        payload["compressedSize"],
+        payload["uncompressedSize"],
+    )
+    shapes = list()
+    compresses = list()
+    for reduce in (False, True):
+        channelToImage = ChannelToImageAD()
+        scaleHint = channelToImage.getCompress(nx, ny, 1, imageSize) if reduce else 1
+        codecAD.decompress(*args, scaleHint=scaleHint)
+        channelToImage.channelToImage(
+            codecAD.getData(), dimArray, imageSize, scale=codecAD.getScale()
+        )
+        channelDict = channelToImage.getChannelDict()
+        shapes.append(channelDict["image"].shape)
+        compresses.append(channelDict["compress"])
+    assert shapes[1] == shapes[0]
+    assert compresses[1] == compresses[0]
+    assert max(shapes[0]) <= imageSize
+
+
+@pytest.mark.parametrize(
+    "pyramid,imageSize,memoryLimit", [(False, 2048, 8 << 20), (True, 512, 16 << 20)]
+)
+@pytest.mark.parametrize("dtypeImage", [np.uint8, np.uint16])
+def testMemoryLimit(dtypeImage, pyramid, imageSize, memoryLimit):
+    # the bytes allocated by channelToImage and getLevels stay within the limit
+    nx = 2048
+    ny = 2048
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 4000 + 1000 * i, (ny, nx), dtype=np.uint16) for i in range(4)]
+    dimArray = createDimArray(nx, ny)
+    channelToImage = ChannelToImageAD()
+    channelToImage.setDtypeImage(dtypeImage)
+    channelToImage.setMemoryLimit(memoryLimit)
+    channelToImage.setPyramid(pyramid)
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        # the previous image and levels are still referenced, as they are by NumpyImage
+        displayed = None
+        for frame in frames:
+            channelToImage.channelToImage(frame, dimArray, imageSize)
+            displayed = (channelToImage.getChannelDict()["image"], channelToImage.getLevels())
+        peak = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    compress = channelToImage.getChannelDict()["compress"]
+    assert compress > 1
+    assert displayed[0].dtype == dtypeImage
+    if pyramid:
+        assert len(displayed[1]) > 0
+    assert peak <= memoryLimit
+
+
+@pytest.mark.parametrize(
+    "nx,ny,imageSize", [(2400, 1800, 800), (3200, 2400, 800), (640, 480, 800)]
+)
+def testBayerShapeMatchesRgb(nx, ny, imageSize):
+    # a Bayer image is decimated exactly as much as the rgb image it is converted to
+    rng = np.random.default_rng(0)
+    mosaic = rng.integers(0, 256, (ny, nx), dtype=np.uint8)
+    channelToImage = ChannelToImageAD()
+    channelToImage.channelToImage(mosaic, createDimArray(nx, ny), imageSize, colorMode=1)
+    bayer = channelToImage.getChannelDict()
+    rgb = rng.integers(0, 256, (ny, nx, 3), dtype=np.uint8)
+    channelToImage = ChannelToImageAD()
+    channelToImage.channelToImage(
+        rgb, [{"size": 3}, {"size": nx}, {"size": ny}], imageSize, colorMode=2
+    )
+    expected = channelToImage.getChannelDict()
+    assert bayer["image"].shape == expected["image"].shape
+    assert bayer["compress"] == expected["compress"]
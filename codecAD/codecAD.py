@@ -10,7 +10,14 @@ NTNDArray has the following fields of interest to a callback:
     uncompressedSize The uncompressed size of the data
     dimension        2d or 3d array description
     
-In order to use this code environment variable LD_LIBRARY_PATH must be defined.
+Each codec can be decoded by several backends:
+    the areaDetector/ADSupport shared libraries, accessed via ctypes,
+    and the python packages blosc, blosc2, lz4, bitshuffle, zstandard, and simplejpeg.
+The codecs blosc2 and zstd are only decoded by the python packages.
+The first time a codec is used every available backend decodes the frame
+and the fastest is used from then on. See CodecRegistry for details.
+
+In order to use the ADSupport libraries environment variable LD_LIBRARY_PATH must be defined.
 For example:
    export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/home/epics7/areaDetector/ADSupport/lib/linux-x86_64
       
@@ -28,6 +35,12 @@ from codecAD import CodecAD
         pass
         " note that data is not changed"
 ...   
+
+A publisher can compress data before sending it:
+...
+    result = self.codecAD.compress(image,"bslz4")
+    " result has value, codec, compressedSize, and uncompressedSize for the NTNDArray"
+...
      
 Copyright - See the COPYRIGHT that is included with this distribution.
     NTNDA_Viewer is distributed subject to a Software License Agreement found
@@ -43,7 +56,1035 @@ import sys
 import ctypes
 import ctypes.util
 import os
+import time
+import math
+import importlib
+import bisect
+import struct
+import collections
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CodecBackend:
+    """
+    A CodecBackend decodes the data for a single codec.
+    The default backends are created by CodecRegistry.
+    A client can provide additional backends via CodecRegistry.register.
+
+    A derived class must implement isAvailable and decompress.
+    A backend that can also compress implements canCompress and compress.
+    A backend that can decode at reduced resolution implements
+    canScale, getScaledShape, and decompressScaled.
+    A backend that can decode part of the data implements canSelect and decompressSelected.
+    """
+
+    def __init__(self, codecName, backendName):
+        """
+         Parameters
+        -----------
+            codecName : str
+                 codec name as provided by the NTNDArray record, e.g. "blosc"
+            backendName : str
+                 name that identifies this backend, e.g. "ADSupport"
+        """
+        self.__codecName = codecName
+        self.__backendName = backendName
+
+    def getCodecName(self):
+        """ get the codec name """
+        return self.__codecName
+
+    def getBackendName(self):
+        """ get the backend name """
+        return self.__backendName
+
+    def isAvailable(self):
+        """
+        Returns
+        -------
+            True if the library or package used by the backend can be loaded
+        """
+        return False
+
+    def setNumThreads(self, numThreads):
+        """
+         Parameters
+        -----------
+            numThreads : int
+                 number of threads the backend may use
+        """
+        pass
+
+    def decompress(self, inarray, outarray, elementsize):
+        """
+         Parameters
+        -----------
+            inarray : numpy array
+                 contiguous uint8 array holding the compressed data
+            outarray : numpy array
+                 contiguous array that receives the decompressed data
+            elementsize : int
+                 size in bytes of each element of the uncompressed data
+
+        An exception is raised if decompression fails.
+        """
+        raise Exception("decompress not implemented")
+
+    def canCompress(self):
+        """
+        Returns
+        -------
+            True if the backend implements compress
+        """
+        return False
+
+    def compress(self, data, options):
+        """
+         Parameters
+        -----------
+            data : numpy array
+                 contiguous array to compress
+            options : dict
+                 codec options. See CodecAD.compress
+
+        Returns
+        -------
+            compressed : numpy uint8 array
+
+        An exception is raised if compression fails.
+        """
+        raise Exception("compress not implemented")
+
+    def canScale(self):
+        """
+        Returns
+        -------
+            True if the backend implements getScaledShape and decompressScaled
+        """
+        return False
+
+    def getScaledShape(self, inarray, scale):
+        """
+         Parameters
+        -----------
+            inarray : numpy array
+                 contiguous uint8 array holding the compressed data
+            scale : int
+                 the image is decoded with width and height reduced by scale
+
+        Returns
+        -------
+            shape : tuple
+                 shape of the decoded image
+        """
+        raise Exception("getScaledShape not implemented")
+
+    def decompressScaled(self, inarray, outarray, scale):
+        """
+         Parameters
+        -----------
+            inarray : numpy array
+                 contiguous uint8 array holding the compressed data
+            outarray : numpy array
+                 contiguous uint8 array with the size given by getScaledShape
+            scale : int
+                 the image is decoded with width and height reduced by scale
+        """
+        raise Exception("decompressScaled not implemented")
+
+    def canSelect(self):
+        """
+        Returns
+        -------
+            True if the backend implements decompressSelected
+        """
+        return False
+
+    def decompressSelected(self, inarray, outarray, elementsize, ranges):
+        """
+        Like decompress but only the elements in ranges must be decoded.
+        The other elements of outarray are undefined.
+
+         Parameters
+        -----------
+            ranges : list
+                 list of (first,end) element index ranges, sorted by first
+        """
+        raise Exception("decompressSelected not implemented")
+
+
+class ADSupportBackend(CodecBackend):
+    """
+    Base class for backends that use an areaDetector/ADSupport shared library.
+    """
+
+    __saveLibrary = dict()
+
+    def __init__(self, codecName, libraryName):
+        CodecBackend.__init__(self, codecName, "ADSupport")
+        self.__libraryName = libraryName
+        self.lib = None
+
+    def __findLibrary(self, name):
+        # a library that was not found is also saved, find_library runs subprocesses
+        if name in ADSupportBackend.__saveLibrary:
+            return ADSupportBackend.__saveLibrary[name]
+        lib = None
+        result = ctypes.util.find_library(name)
+        if result != None:
+            if os.name == "nt":
+                lib = ctypes.windll.LoadLibrary(result)
+            else:
+                lib = ctypes.cdll.LoadLibrary(result)
+        ADSupportBackend.__saveLibrary.update({name: lib})
+        return lib
+
+    def isAvailable(self):
+        if self.lib == None:
+            try:
+                self.lib = self.__findLibrary(self.__libraryName)
+            except Exception:
+                self.lib = None
+        return self.lib != None
+
+
+class BloscADSupport(ADSupportBackend):
+    """ blosc via ADSupport library blosc """
+
+    def __init__(self):
+        ADSupportBackend.__init__(self, "blosc", "blosc")
+        self.__numThreads = 1
+        self.__bloscThreads = None
+
+    def setNumThreads(self, numThreads):
+        self.__numThreads = numThreads
+
+    def decompress(self, inarray, outarray, elementsize):
+        if self.__bloscThreads != self.__numThreads:
+            self.lib.blosc_set_nthreads(self.__numThreads)
+            self.__bloscThreads = self.__numThreads
+        status = self.lib.blosc_decompress(
+            ctypes.c_void_p(inarray.ctypes.data),
+            ctypes.c_void_p(outarray.ctypes.data),
+            ctypes.c_size_t(outarray.nbytes),
+        )
+        if status <= 0:
+            raise Exception("blosc_decompress failed status=" + str(status))
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        self.lib.blosc_set_compressor(options["compressor"].encode())
+        outarray = np.empty(data.nbytes + 16, dtype=np.uint8)
+        status = self.lib.blosc_compress(
+            options["level"],
+            options["shuffle"],
+            ctypes.c_size_t(data.itemsize),
+            ctypes.c_size_t(data.nbytes),
+            ctypes.c_void_p(data.ctypes.data),
+            ctypes.c_void_p(outarray.ctypes.data),
+            ctypes.c_size_t(outarray.nbytes),
+        )
+        if status <= 0:
+            raise Exception("blosc_compress failed status=" + str(status))
+        return outarray[:status]
+
+
+class Lz4ADSupport(ADSupportBackend):
+    """ lz4 via ADSupport library bitshuffle """
+
+    def __init__(self):
+        ADSupportBackend.__init__(self, "lz4", "bitshuffle")
+
+    def decompress(self, inarray, outarray, elementsize):
+        status = self.lib.LZ4_decompress_fast(
+            ctypes.c_void_p(inarray.ctypes.data),
+            ctypes.c_void_p(outarray.ctypes.data),
+            outarray.nbytes,
+        )
+        if status < 0:
+            raise Exception("LZ4_decompress_fast failed status=" + str(status))
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        bound = self.lib.LZ4_compressBound(data.nbytes)
+        outarray = np.empty(bound, dtype=np.uint8)
+        status = self.lib.LZ4_compress_default(
+            ctypes.c_void_p(data.ctypes.data),
+            ctypes.c_void_p(outarray.ctypes.data),
+            data.nbytes,
+            bound,
+        )
+        if status <= 0:
+            raise Exception("LZ4_compress_default failed status=" + str(status))
+        return outarray[:status]
+
+
+class Bslz4Blocks:
+    """
+    Index of the blocks of data compressed by bshuf_compress_lz4 with the default block size.
+    Each block is preceded by its compressed size as a 4 byte big endian integer.
+    The elements after the last full block are one partial block followed by
+    up to 7 leftover elements that are not compressed.
+    The blocks are independent, so any run of consecutive blocks can be decoded
+    by bshuf_decompress_lz4 given the input offset of its first block.
+    """
+
+    __blockHeader = struct.Struct(">I")
+
+    @staticmethod
+    def getBlockSize(elementsize):
+        """ Returns the number of elements in a block """
+        return max(int(8192 / elementsize) // 8 * 8, 128)
+
+    def __init__(self, inarray, nelements, elementsize):
+        self.nelements = nelements
+        self.nbytes = inarray.nbytes
+        self.blockSize = self.getBlockSize(elementsize)
+        self.numBlocks = nelements // self.blockSize
+        self.inarray = inarray
+        # offsets[numBlocks] is the offset of the partial block and leftover elements.
+        # The block sizes are only read as far as a segment needs them.
+        self.offsets = [0]
+
+    def getOffset(self, block):
+        """ Returns the input offset of block """
+        offsets = self.offsets
+        if block >= len(offsets):
+            unpack = self.__blockHeader.unpack_from
+            inarray = self.inarray
+            offset = offsets[-1]
+            for i in range(len(offsets), block + 1):
+                offset += 4 + unpack(inarray, offset)[0]
+                offsets.append(offset)
+        return offsets[block]
+
+    def getSegment(self, first, last):
+        """
+        Returns (inOffset,inEnd,outElement,nelements) for blocks first,...,last-1.
+        Block numBlocks is the partial block plus leftover elements.
+        """
+        if last > self.numBlocks:
+            num = self.nelements - first * self.blockSize
+            inEnd = self.nbytes
+        else:
+            num = (last - first) * self.blockSize
+            inEnd = self.getOffset(last)
+        return (self.getOffset(first), inEnd, first * self.blockSize, num)
+
+    def split(self, numSegments):
+        """ Returns a list of segments that together cover all the data """
+        numBlocks = self.numBlocks + 1
+        bounds = [int(i * numBlocks / numSegments) for i in range(numSegments + 1)]
+        return [
+            self.getSegment(bounds[i], bounds[i + 1])
+            for i in range(numSegments)
+            if bounds[i + 1] > bounds[i]
+        ]
+
+    def select(self, ranges):
+        """ Returns a list of segments that cover the (first,end) element ranges """
+        segments = list()
+        first = None
+        last = None
+        for start, end in ranges:
+            if end <= start:
+                continue
+            firstBlock = min(start // self.blockSize, self.numBlocks)
+            lastBlock = min((end - 1) // self.blockSize, self.numBlocks) + 1
+            if first != None and firstBlock <= last:
+                last = max(last, lastBlock)
+                continue
+            if first != None:
+                segments.append(self.getSegment(first, last))
+            first = firstBlock
+            last = lastBlock
+        if first != None:
+            segments.append(self.getSegment(first, last))
+        return segments
+
+
+class Bslz4ADSupport(ADSupportBackend):
+    """
+    bslz4 via ADSupport library bitshuffle.
+    If more than one thread is requested the blocks are decompressed in parallel.
+    """
+
+    def __init__(self):
+        ADSupportBackend.__init__(self, "bslz4", "bitshuffle")
+        self.__numThreads = 1
+        self.__executor = None
+
+    def setNumThreads(self, numThreads):
+        if numThreads == self.__numThreads:
+            return
+        if self.__executor != None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+        self.__numThreads = numThreads
+
+    def __decompressSegments(self, inarray, outarray, elementsize, blocks, segments):
+        lib = self.lib
+        lib.bshuf_decompress_lz4.restype = ctypes.c_int64
+        inaddress = inarray.ctypes.data
+        outaddress = outarray.ctypes.data
+
+        def decompressSegment(segment):
+            return lib.bshuf_decompress_lz4(
+                ctypes.c_void_p(inaddress + segment[0]),
+                ctypes.c_void_p(outaddress + segment[2] * elementsize),
+                ctypes.c_size_t(segment[3]),
+                ctypes.c_size_t(elementsize),
+                ctypes.c_size_t(blocks.blockSize),
+            )
+
+        if self.__numThreads > 1 and len(segments) > 1:
+            if self.__executor == None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.__numThreads)
+            results = self.__executor.map(decompressSegment, segments)
+        else:
+            results = map(decompressSegment, segments)
+        for status in results:
+            if status < 0:
+                raise Exception("bshuf_decompress_lz4 failed status=" + str(status))
+
+    def decompress(self, inarray, outarray, elementsize):
+        nelements = int(outarray.nbytes / elementsize)
+        if self.__numThreads <= 1:
+            self.lib.bshuf_decompress_lz4.restype = ctypes.c_int64
+            status = self.lib.bshuf_decompress_lz4(
+                ctypes.c_void_p(inarray.ctypes.data),
+                ctypes.c_void_p(outarray.ctypes.data),
+                ctypes.c_size_t(nelements),
+                ctypes.c_size_t(elementsize),
+                ctypes.c_size_t(0),
+            )
+            if status < 0:
+                raise Exception("bshuf_decompress_lz4 failed status=" + str(status))
+            return
+        # each thread decompresses a contiguous group of blocks
+        blocks = Bslz4Blocks(inarray, nelements, elementsize)
+        segments = blocks.split(self.__numThreads)
+        self.__decompressSegments(inarray, outarray, elementsize, blocks, segments)
+
+    def canSelect(self):
+        return True
+
+    def decompressSelected(self, inarray, outarray, elementsize, ranges):
+        nelements = int(outarray.nbytes / elementsize)
+        blocks = Bslz4Blocks(inarray, nelements, elementsize)
+        segments = blocks.select(ranges)
+        self.__decompressSegments(inarray, outarray, elementsize, blocks, segments)
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        lib = self.lib
+        lib.bshuf_compress_lz4_bound.restype = ctypes.c_size_t
+        lib.bshuf_compress_lz4.restype = ctypes.c_int64
+        nelements = ctypes.c_size_t(data.size)
+        elementsize = ctypes.c_size_t(data.itemsize)
+        bound = lib.bshuf_compress_lz4_bound(nelements, elementsize, ctypes.c_size_t(0))
+        outarray = np.empty(bound, dtype=np.uint8)
+        status = lib.bshuf_compress_lz4(
+            ctypes.c_void_p(data.ctypes.data),
+            ctypes.c_void_p(outarray.ctypes.data),
+            nelements,
+            elementsize,
+            ctypes.c_size_t(0),
+        )
+        if status < 0:
+            raise Exception("bshuf_compress_lz4 failed status=" + str(status))
+        return outarray[:status]
+
+
+class JpegADSupport(ADSupportBackend):
+    """ jpeg via ADSupport library decompressJPEG """
+
+    def __init__(self):
+        ADSupportBackend.__init__(self, "jpeg", "decompressJPEG")
+
+    def decompress(self, inarray, outarray, elementsize):
+        self.lib.decompressJPEG(
+            ctypes.c_void_p(inarray.ctypes.data),
+            inarray.nbytes,
+            ctypes.c_void_p(outarray.ctypes.data),
+            outarray.nbytes,
+        )
+
+
+class PythonBackend(CodecBackend):
+    """
+    Base class for backends that use a python package.
+    The package is imported the first time isAvailable is called.
+    """
+
+    def __init__(self, codecName, moduleName):
+        CodecBackend.__init__(self, codecName, moduleName)
+        self.__moduleName = moduleName
+        self.__triedImport = False
+        self.module = None
+
+    def isAvailable(self):
+        if not self.__triedImport:
+            self.__triedImport = True
+            try:
+                self.module = importlib.import_module(self.__moduleName)
+            except Exception:
+                self.module = None
+        return self.module != None
+
+
+class BloscPython(PythonBackend):
+    """ blosc via python package blosc """
+
+    def __init__(self):
+        PythonBackend.__init__(self, "blosc", "blosc")
+
+    def setNumThreads(self, numThreads):
+        if self.module != None:
+            self.module.set_nthreads(numThreads)
+
+    def decompress(self, inarray, outarray, elementsize):
+        self.module.decompress_ptr(inarray, outarray.ctypes.data)
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        result = self.module.compress_ptr(
+            data.ctypes.data,
+            data.size,
+            typesize=data.itemsize,
+            clevel=options["level"],
+            shuffle=options["shuffle"],
+            cname=options["compressor"],
+        )
+        return np.frombuffer(result, dtype=np.uint8)
+
+
+class Blosc2Python(PythonBackend):
+    """
+    blosc2 via python package blosc2.
+    It also decodes blosc version 1 data, so it is registered for both codecs.
+    """
+
+    def __init__(self, codecName="blosc"):
+        PythonBackend.__init__(self, codecName, "blosc2")
+
+    def setNumThreads(self, numThreads):
+        if self.module != None:
+            self.module.set_nthreads(numThreads)
+
+    def decompress(self, inarray, outarray, elementsize):
+        self.module.decompress(inarray, dst=outarray)
+
+    def canCompress(self):
+        # blosc version 1 decoders can not read blosc2 chunks
+        return self.getCodecName() == "blosc2"
+
+    def compress(self, data, options):
+        filters = (
+            self.module.Filter.NOFILTER,
+            self.module.Filter.SHUFFLE,
+            self.module.Filter.BITSHUFFLE,
+        )
+        result = self.module.compress(
+            data,
+            typesize=data.itemsize,
+            clevel=options["level"],
+            filter=filters[options["shuffle"]],
+            codec=self.module.Codec[options["compressor"].upper()],
+        )
+        return np.frombuffer(result, dtype=np.uint8)
+
+
+class ZstdPython(PythonBackend):
+    """ zstd via python package zstandard """
+
+    def __init__(self):
+        PythonBackend.__init__(self, "zstd", "zstandard")
+
+    def decompress(self, inarray, outarray, elementsize):
+        # the stream reader writes directly into outarray
+        outbytes = outarray.view(np.uint8)
+        reader = self.module.ZstdDecompressor().stream_reader(inarray)
+        nbytes = 0
+        while nbytes < outbytes.nbytes:
+            num = reader.readinto(outbytes[nbytes:])
+            if num == 0:
+                raise Exception("zstd data is shorter than uncompressedSize")
+            nbytes += num
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        compressor = self.module.ZstdCompressor(level=options["level"])
+        return np.frombuffer(compressor.compress(data), dtype=np.uint8)
+
+
+class Lz4Python(PythonBackend):
+    """ lz4 via python package lz4 """
+
+    def __init__(self):
+        PythonBackend.__init__(self, "lz4", "lz4.block")
+
+    def decompress(self, inarray, outarray, elementsize):
+        result = self.module.decompress(inarray, uncompressed_size=outarray.nbytes)
+        outarray.view(np.uint8)[:] = np.frombuffer(result, dtype=np.uint8)
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        result = self.module.compress(data, store_size=False)
+        return np.frombuffer(result, dtype=np.uint8)
+
+
+class Bslz4Python(PythonBackend):
+    """ bslz4 via python package bitshuffle """
+
+    def __init__(self):
+        PythonBackend.__init__(self, "bslz4", "bitshuffle")
+
+    def decompress(self, inarray, outarray, elementsize):
+        result = self.module.decompress_lz4(
+            inarray, outarray.shape, outarray.dtype, 0
+        )
+        outarray[:] = result
+
+    def canSelect(self):
+        return True
+
+    def decompressSelected(self, inarray, outarray, elementsize, ranges):
+        blocks = Bslz4Blocks(inarray, outarray.size, elementsize)
+        for inOffset, inEnd, outElement, num in blocks.select(ranges):
+            outarray[outElement : outElement + num] = self.module.decompress_lz4(
+                inarray[inOffset:inEnd], (num,), outarray.dtype, blocks.blockSize
+            )
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        return self.module.compress_lz4(data.reshape(-1), 0)
+
+
+class JpegSimplejpeg(PythonBackend):
+    """ jpeg via python package simplejpeg, which uses libjpeg-turbo """
+
+    def __init__(self):
+        PythonBackend.__init__(self, "jpeg", "simplejpeg")
+
+    def decompress(self, inarray, outarray, elementsize):
+        header = self.module.decode_jpeg_header(inarray)
+        colorspace = "GRAY" if header[2] == "Gray" else "RGB"
+        self.module.decode_jpeg(inarray, colorspace, buffer=outarray)
+
+    def canCompress(self):
+        return True
+
+    def compress(self, data, options):
+        if data.ndim == 2:
+            image = data.reshape(data.shape[0], data.shape[1], 1)
+            colorspace = "GRAY"
+        else:
+            image = data
+            colorspace = "RGB"
+        result = self.module.encode_jpeg(image, options["quality"], colorspace)
+        return np.frombuffer(result, dtype=np.uint8)
+
+    def canScale(self):
+        return True
+
+    def getScaledShape(self, inarray, scale):
+        header = self.module.decode_jpeg_header(inarray)
+        nz = 1 if header[2] == "Gray" else 3
+        return (math.ceil(header[0] / scale), math.ceil(header[1] / scale), nz)
+
+    def decompressScaled(self, inarray, outarray, scale):
+        # libjpeg selects the smallest DCT scaling that is at least min_height,min_width
+        shape = self.getScaledShape(inarray, scale)
+        colorspace = "GRAY" if shape[2] == 1 else "RGB"
+        result = self.module.decode_jpeg(
+            inarray,
+            colorspace,
+            min_height=shape[0],
+            min_width=shape[1],
+            buffer=outarray,
+        )
+        if result.shape != shape:
+            raise Exception("decode_jpeg scaled shape " + str(result.shape))
+
+
+class CodecRegistry:
+    """
+    CodecRegistry holds the backends for each codec.
+
+    The first time a codec is decompressed every available backend decodes the frame.
+    The fastest one is remembered and used for all following frames.
+    A client can override the choice via setBackend.
+
+    Normal use is:
+    ...
+        registry = CodecRegistry()
+        registry.register(MyBackend())
+        codecAD = CodecAD(registry=registry)
+    ...
+    """
+
+    def __init__(self):
+        self.__backends = dict()
+        self.__selected = dict()
+        self.__numThreads = 1
+        for backend in (
+            BloscADSupport(),
+            BloscPython(),
+            Blosc2Python(),
+            Blosc2Python("blosc2"),
+            ZstdPython(),
+            Lz4ADSupport(),
+            Lz4Python(),
+            Bslz4ADSupport(),
+            Bslz4Python(),
+            JpegADSupport(),
+            JpegSimplejpeg(),
+        ):
+            self.register(backend)
+
+    def register(self, backend):
+        """
+         Parameters
+        -----------
+            backend : CodecBackend
+                 backend to add. A backend with the same codec and backend name is replaced.
+        """
+        codecName = backend.getCodecName()
+        backends = self.__backends.setdefault(codecName, list())
+        for existing in list(backends):
+            if existing.getBackendName() == backend.getBackendName():
+                backends.remove(existing)
+        backends.append(backend)
+        backend.setNumThreads(self.__numThreads)
+        self.__selected.pop(codecName, None)
+
+    def getCodecNames(self):
+        """ get a list of the codec names that have at least one backend """
+        return list(self.__backends.keys())
+
+    def getBackendNames(self, codecName):
+        """ get a list of the available backend names for codecName """
+        backends = self.__backends.get(codecName, list())
+        return [b.getBackendName() for b in backends if b.isAvailable()]
+
+    def getBackend(self, codecName, backendName=None):
+        """
+         Parameters
+        -----------
+            codecName : str
+                 codec name
+            backendName : str
+                 backend name. If None the selected backend is returned.
+
+        Returns
+        -------
+            backend : CodecBackend or None
+        """
+        if backendName == None:
+            return self.__selected.get(codecName)
+        for backend in self.__backends.get(codecName, list()):
+            if backend.getBackendName() == backendName:
+                return backend
+        return None
+
+    def setBackend(self, codecName, backendName):
+        """
+         Parameters
+        -----------
+            codecName : str
+                 codec name
+            backendName : str
+                 backend to use for codecName.
+                 If None the fastest backend is selected the next time codecName is used.
+        """
+        if backendName == None:
+            self.__selected.pop(codecName, None)
+            return
+        backend = self.getBackend(codecName, backendName)
+        if backend == None or not backend.isAvailable():
+            raise Exception(backendName + " is not available for codec " + codecName)
+        backend.setNumThreads(self.__numThreads)
+        self.__selected[codecName] = backend
+
+    def setNumThreads(self, numThreads):
+        """
+         Parameters
+        -----------
+            numThreads : int
+                 number of threads each backend may use
+        """
+        self.__numThreads = numThreads
+        for backends in self.__backends.values():
+            for backend in backends:
+                backend.setNumThreads(numThreads)
+
+    def compress(self, codecName, data, options):
+        """
+        compress with the selected backend if it can compress,
+        otherwise with the first available backend that can compress.
+        See CodecBackend.compress for the arguments.
+
+        Returns
+        -------
+            compressed : numpy uint8 array
+        """
+        if codecName not in self.__backends:
+            raise Exception(codecName + " is unsupported codec")
+        backend = self.__selected.get(codecName)
+        if backend == None or not backend.canCompress():
+            backend = None
+            for candidate in self.__backends[codecName]:
+                if candidate.canCompress() and candidate.isAvailable():
+                    backend = candidate
+                    break
+        if backend == None:
+            raise Exception("no backend can compress codec " + codecName)
+        return backend.compress(data, options)
+
+    def getScaleBackend(self, codecName):
+        """
+        Returns
+        -------
+            backend : CodecBackend or None
+                 The selected backend if it can scale,
+                 otherwise the first available backend that can scale.
+        """
+        backend = self.__selected.get(codecName)
+        if backend != None and backend.canScale():
+            return backend
+        for backend in self.__backends.get(codecName, list()):
+            if backend.canScale() and backend.isAvailable():
+                return backend
+        return None
+
+    def getSelectBackend(self, codecName):
+        """
+        Returns
+        -------
+            backend : CodecBackend or None
+                 The selected backend if it can decode part of the data,
+                 otherwise the first available backend that can.
+        """
+        backend = self.__selected.get(codecName)
+        if backend != None and backend.canSelect():
+            return backend
+        for backend in self.__backends.get(codecName, list()):
+            if backend.canSelect() and backend.isAvailable():
+                return backend
+        return None
+
+    def decompress(self, codecName, inarray, outarray, elementsize):
+        """
+        decompress with the selected backend, selecting it first if necessary.
+        See CodecBackend.decompress for the arguments.
+
+        Returns
+        -------
+            backend : CodecBackend
+                 the backend that decompressed the data
+        """
+        if codecName not in self.__backends:
+            raise Exception(codecName + " is unsupported codec")
+        backend = self.__selected.get(codecName)
+        if backend != None:
+            backend.decompress(inarray, outarray, elementsize)
+            return backend
+        candidates = list()
+        for backend in self.__backends.get(codecName, list()):
+            if backend.isAvailable():
+                backend.setNumThreads(self.__numThreads)
+                candidates.append(backend)
+        if len(candidates) == 0:
+            raise Exception("no backend available for codec " + codecName)
+        best = None
+        bestTime = None
+        last = None
+        error = None
+        for backend in candidates:
+            try:
+                elapsed = None
+                for i in range(2):
+                    last = backend
+                    start = time.perf_counter()
+                    backend.decompress(inarray, outarray, elementsize)
+                    now = time.perf_counter() - start
+                    if elapsed == None or now < elapsed:
+                        elapsed = now
+            except Exception as exc:
+                error = exc
+                continue
+            if bestTime == None or elapsed < bestTime:
+                best = backend
+                bestTime = elapsed
+        if best == None:
+            raise Exception("all backends failed for codec " + codecName + ": " + str(error))
+        if last != best:
+            best.decompress(inarray, outarray, elementsize)
+        self.__selected[codecName] = best
+        return best
+
+
+class CodecStatistics:
+    """
+    CodecStatistics accumulates decompression statistics for each codec:
+        frames       number of frames decompressed
+        failures     number of frames that could not be decompressed
+        bytesIn      total compressed bytes
+        bytesOut     total uncompressed bytes
+        seconds      total decode time
+        histogram    number of frames for each decode time bin. See getBinEdges.
+        compressRatio  bytesOut/bytesIn for the last window frames
+    Updating and reading the statistics is cheap, so a client can read them for every frame.
+    """
+
+    # upper edge in seconds of each decode time bin. The last bin has no upper edge.
+    __binEdges = (
+        0.0001,
+        0.0002,
+        0.0005,
+        0.001,
+        0.002,
+        0.005,
+        0.01,
+        0.02,
+        0.05,
+        0.1,
+        0.2,
+        0.5,
+        1.0,
+    )
+
+    def __init__(self, window=100):
+        """
+         Parameters
+        -----------
+            window : int
+                 number of frames used for the rolling compressRatio
+        """
+        self.__window = max(int(window), 1)
+        self.__codecs = dict()
+
+    def __createCodecDict(self):
+        return {
+            "frames": 0,
+            "failures": 0,
+            "bytesIn": 0,
+            "bytesOut": 0,
+            "seconds": 0.0,
+            "histogram": [0] * (len(self.__binEdges) + 1),
+            "window": collections.deque(),
+            "windowIn": 0,
+            "windowOut": 0,
+        }
+
+    def __getCodecDict(self, codecName):
+        codecDict = self.__codecs.get(codecName)
+        if codecDict == None:
+            codecDict = self.__createCodecDict()
+            self.__codecs[codecName] = codecDict
+        return codecDict
+
+    def reset(self):
+        """ discard all statistics """
+        self.__codecs = dict()
+
+    def getBinEdges(self):
+        """
+        Returns
+        -------
+        binEdges : tuple
+            histogram[i] counts frames with binEdges[i-1] <= seconds < binEdges[i]
+        """
+        return self.__binEdges
+
+    def addFrame(self, codecName, bytesIn, bytesOut, seconds):
+        """ record a frame that was decompressed in seconds """
+        codecDict = self.__getCodecDict(codecName)
+        codecDict["frames"] += 1
+        codecDict["bytesIn"] += bytesIn
+        codecDict["bytesOut"] += bytesOut
+        codecDict["seconds"] += seconds
+        codecDict["histogram"][bisect.bisect_right(self.__binEdges, seconds)] += 1
+        window = codecDict["window"]
+        window.append((bytesIn, bytesOut))
+        codecDict["windowIn"] += bytesIn
+        codecDict["windowOut"] += bytesOut
+        if len(window) > self.__window:
+            oldIn, oldOut = window.popleft()
+            codecDict["windowIn"] -= oldIn
+            codecDict["windowOut"] -= oldOut
+
+    def addFailure(self, codecName):
+        """ record a frame that could not be decompressed """
+        self.__getCodecDict(codecName)["failures"] += 1
+
+    def getCodecNames(self):
+        """
+        Returns
+        -------
+        codecNames : list
+            names of the codecs that have statistics
+        """
+        return list(self.__codecs.keys())
+
+    def getCompressRatio(self, codecName=None):
+        """
+        Returns
+        -------
+        compressRatio : float
+            rolling compress ratio for codecName or, if None, for all codecs.
+            0.0 if no frame has been decompressed.
+        """
+        if codecName != None:
+            codecDicts = [self.__codecs.get(codecName, self.__createCodecDict())]
+        else:
+            codecDicts = self.__codecs.values()
+        windowIn = sum(codecDict["windowIn"] for codecDict in codecDicts)
+        if windowIn == 0:
+            return 0.0
+        return sum(codecDict["windowOut"] for codecDict in codecDicts) / windowIn
+
+    def getStatistics(self, codecName=None):
+        """
+        Returns
+        -------
+        statistics : dict
+            frames, failures, bytesIn, bytesOut, seconds, meanSeconds, histogram,
+            and compressRatio for codecName or, if None, the sum over all codecs.
+        """
+        if codecName != None:
+            codecDicts = [self.__codecs.get(codecName, self.__createCodecDict())]
+        else:
+            codecDicts = list(self.__codecs.values())
+        statistics = dict()
+        for name in ("frames", "failures", "bytesIn", "bytesOut", "seconds"):
+            statistics[name] = sum(codecDict[name] for codecDict in codecDicts)
+        statistics["meanSeconds"] = 0.0
+        if statistics["frames"] > 0:
+            statistics["meanSeconds"] = statistics["seconds"] / statistics["frames"]
+        histogram = [0] * (len(self.__binEdges) + 1)
+        for codecDict in codecDicts:
+            for i, count in enumerate(codecDict["histogram"]):
+                histogram[i] += count
+        statistics["histogram"] = histogram
+        statistics["compressRatio"] = self.getCompressRatio(codecName)
+        return statistics
 
 
 class CodecAD:
@@ -58,7 +1099,11 @@ class CodecAD:
         uncompressedSize The uncompressed size of the data
         dimension        2d or 3d array description
 
-    In order to use this code environment variable LD_LIBRARY_PATH must be defined.
+    The codecs are decoded by backends provided by a CodecRegistry.
+    The ADSupport libraries and the python packages blosc, blosc2, lz4, bitshuffle,
+    zstandard, and simplejpeg are supported. The fastest available backend is selected for each codec.
+
+    In order to use the ADSupport libraries environment variable LD_LIBRARY_PATH must be defined.
     For example:
        export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/home/epics7/areaDetector/ADSupport/lib/linux-x86_64
 
@@ -77,6 +1122,12 @@ class CodecAD:
             " note that data is not changed"
     ...
 
+    A publisher can compress data before sending it:
+    ...
+        result = self.codecAD.compress(image,"bslz4")
+        " result has value, codec, compressedSize, and uncompressedSize for the NTNDArray"
+    ...
+
     Copyright - See the COPYRIGHT that is included with this distribution.
         NTNDA_Viewer is distributed subject to a Software License Agreement found
         in file LICENSE that is included with this distribution.
@@ -87,26 +1138,115 @@ class CodecAD:
     latest date 2020.07.30
     """
 
-    def __init__(self):
+    # codec["parameters"] is the pvData scalar type of the uncompressed data
+    __typeMap = {
+        1: "int8",
+        2: "int16",
+        3: "int32",
+        4: "int64",
+        5: "uint8",
+        6: "uint16",
+        7: "uint32",
+        8: "uint64",
+        9: "float32",
+        10: "float64",
+    }
+
+    def __init__(self, numBuffers=2, numThreads=1, registry=None):
+        """
+         Parameters
+        -----------
+            numBuffers : int
+                 number of output buffers kept for each (dtype,size).
+                 The data returned by getData is only overwritten after
+                 it is no longer referenced, so 2 gives double buffering.
+            numThreads : int
+                 number of threads used to decompress blosc and bslz4 data.
+            registry : CodecRegistry
+                 registry that provides the codec backends.
+                 If None a registry with the default backends is created.
+        """
         self.__codecName = "none"
         self.__data = None
         self.__compressRatio = 1.0
-        self.__saveLibrary = dict()
+        self.__bufferPool = self.__BufferPool(numBuffers)
+        if registry == None:
+            registry = CodecRegistry()
+        self.__registry = registry
+        self.__backendName = "none"
+        self.__scale = 1
+        self.__rowSelection = None
+        self.__statistics = CodecStatistics()
+        self.__numThreads = 1
+        self.setNumThreads(numThreads)
 
-    def __findLibrary(self, name):
-        lib = self.__saveLibrary.get(name)
-        if lib != None:
-            return lib
-        result = ctypes.util.find_library(name)
-        if result == None:
-            return None
-        if os.name == "nt":
-            lib = ctypes.windll.LoadLibrary(result)
-        else:
-            lib = ctypes.cdll.LoadLibrary(result)
-        if lib != None:
-            self.__saveLibrary.update({name: lib})
-        return lib
+    def getRegistry(self):
+        """
+        Returns
+        -------
+        registry : CodecRegistry
+            the registry that provides the codec backends
+        """
+        return self.__registry
+
+    def getStatistics(self):
+        """
+        Returns
+        -------
+        statistics : CodecStatistics
+            statistics for all frames passed to decompress
+        """
+        return self.__statistics
+
+    def setNumThreads(self, numThreads):
+        """
+         Parameters
+        -----------
+            numThreads : int
+                 number of threads used to decompress blosc and bslz4 data.
+                 blosc uses its own thread pool.
+                 bslz4 blocks are decompressed in parallel by the ADSupport backend.
+        """
+        self.__numThreads = max(int(numThreads), 1)
+        self.__registry.setNumThreads(self.__numThreads)
+
+    def getNumThreads(self):
+        """
+        Returns
+        -------
+        numThreads : int
+            number of threads used to decompress blosc and bslz4 data.
+        """
+        return self.__numThreads
+
+    def getBackendName(self):
+        """
+        Returns
+        -------
+        backendName : str
+            name of the backend used for the last decompress
+        """
+        return self.__backendName
+
+    def getScale(self):
+        """
+        Returns
+        -------
+        scale : int
+            1 if the last decompress produced the full image.
+            Otherwise width and height were reduced by scale. See decompress.
+        """
+        return self.__scale
+
+    def getRowSelection(self):
+        """
+        Returns
+        -------
+        rowSelection : tuple or None
+            None if the last decompress decoded all the data.
+            Otherwise the rowSelection passed to decompress. See decompress.
+        """
+        return self.__rowSelection
 
     def getCodecName(self):
         """
@@ -135,7 +1275,9 @@ class CodecAD:
         """
         return self.__compressRatio
 
-    def decompress(self, data, codec, compressed, uncompressed):
+    def decompress(
+        self, data, codec, compressed, uncompressed, scaleHint=1, rowSelection=None
+    ):
         """
         decompress data described by codec.
         The arguments are all provided by a callback from an NTNDArray record.
@@ -147,6 +1289,21 @@ class CodecAD:
             codec:        Provided by the NTNDArray record.
             compressed:   Provided by the NTNDArray record.
             uncompressed: Provided by the NTNDArray record.
+            scaleHint:    The client will reduce width and height by this factor.
+                          For jpeg a backend that supports DCT scaling decodes
+                          at 1/2, 1/4, or 1/8 resolution, using the largest of these factors
+                          that divides scaleHint, so that the client only has to reduce
+                          the decoded data by scaleHint/getScale.
+                          getScale returns the factor that was used.
+            rowSelection: None or (rowElements,start,stop,step).
+                          The client only uses rows range(start,stop,step) where
+                          each row has rowElements elements.
+                          For bslz4 only the blocks that hold these rows are decoded
+                          and the other rows of getData are zero.
+                          A reused buffer only has the rows that an earlier
+                          selection decoded cleared, so the cost follows the
+                          number of selected rows, not the size of the data.
+                          getRowSelection returns None if all the data was decoded.
 
         Returns
         -------
@@ -156,97 +1313,355 @@ class CodecAD:
             True
                 decompression was done.
                 getCodecName, getData, and getCompressRatio provide the results
+
+        Each decompression is timed and recorded by getStatistics.
+        A decompression that raises an exception is recorded as a failure.
+
+        The compressed data is read directly from the numpy array provided by the callback.
+        The result is written into a buffer owned by codecAD and getData returns that buffer.
+        A buffer is only reused when neither the client nor codecAD references it,
+        so an image still being displayed is never overwritten.
+        A view of the data, e.g. a reshape, also references it.
+        While more than numBuffers results are referenced a new buffer is allocated
+        for each decompress.
         """
         self.__codecName = codec["name"]
         if len(self.__codecName) == 0:
             self.__data = None
             self.__codecName = "none"
+            self.__backendName = "none"
+            self.__scale = 1
+            self.__rowSelection = None
             self.__compressRatio = 1.0
             return False
+        start = time.perf_counter()
+        try:
+            self.__decompress(
+                data, codec, compressed, uncompressed, scaleHint, rowSelection
+            )
+        except Exception:
+            self.__statistics.addFailure(self.__codecName)
+            raise
+        self.__statistics.addFrame(
+            self.__codecName, compressed, uncompressed, time.perf_counter() - start
+        )
+        return True
+
+    def __decompress(
+        self, data, codec, compressed, uncompressed, scaleHint, rowSelection
+    ):
         typevalue = codec["parameters"]
-        if typevalue == 1:
-            dtype = "int8"
-            elementsize = int(1)
-        elif typevalue == 5:
-            dtype = "uint8"
-            elementsize = int(1)
-        elif typevalue == 2:
-            dtype = "int16"
-            elementsize = int(2)
-        elif typevalue == 6:
-            dtype = "uint16"
-            elementsize = int(2)
-        elif typevalue == 3:
-            dtype = "int32"
-            elementsize = int(4)
-        elif typevalue == 7:
-            dtype = "uint32"
-            elementsize = int(4)
-        elif typevalue == 4:
-            dtype = "int64"
-            elementsize = int(8)
-        elif typevalue == 8:
-            dtype = "uint64"
-            elementsize = int(8)
-        elif typevalue == 9:
-            dtype = "float32"
-            elementsize = int(4)
-        elif typevalue == 10:
-            dtype = "float64"
-            elementsize = int(8)
-        else:
+        if typevalue not in self.__typeMap:
             raise Exception("decompress mapIntToType failed")
-        if self.__codecName == "blosc":
-            lib = self.__findLibrary(self.__codecName)
-        elif self.__codecName == "jpeg":
-            lib = self.__findLibrary("decompressJPEG")
-        elif self.__codecName == "lz4" or self.__codecName == "bslz4":
-            lib = self.__findLibrary("bitshuffle")
+        dtype = self.__typeMap[typevalue]
+        elementsize = np.dtype(dtype).itemsize
+        if isinstance(data, np.ndarray):
+            inarray = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
         else:
-            lib = None
-        if lib == None:
-            raise Exception("shared library " + self.codecName + " not found")
-        inarray = bytearray(data)
-        in_char_array = ctypes.c_ubyte * compressed
-        out_char_array = ctypes.c_ubyte * uncompressed
-        outarray = bytearray(uncompressed)
-        if self.__codecName == "blosc":
-            lib.blosc_decompress(
-                in_char_array.from_buffer(inarray),
-                out_char_array.from_buffer(outarray),
-                uncompressed,
-            )
-            data = np.array(outarray)
-            data = np.frombuffer(data, dtype=dtype)
-        elif self.__codecName == "lz4":
-            lib.LZ4_decompress_fast(
-                in_char_array.from_buffer(inarray),
-                out_char_array.from_buffer(outarray),
-                uncompressed,
-            )
-            data = np.array(outarray)
-            data = np.frombuffer(data, dtype=dtype)
-        elif self.__codecName == "bslz4":
-            lib.bshuf_decompress_lz4(
-                in_char_array.from_buffer(inarray),
-                out_char_array.from_buffer(outarray),
-                int(uncompressed / elementsize),
-                elementsize,
-                int(0),
-            )
-            data = np.array(outarray)
-            data = np.frombuffer(data, dtype=dtype)
-        elif self.__codecName == "jpeg":
-            lib.decompressJPEG(
-                in_char_array.from_buffer(inarray),
-                compressed,
-                out_char_array.from_buffer(outarray),
-                uncompressed,
+            inarray = np.frombuffer(data, dtype=np.uint8)
+        if compressed < inarray.nbytes:
+            inarray = inarray[:compressed]
+        self.__data = None
+        self.__scale = 1
+        self.__rowSelection = None
+        if self.__codecName == "bslz4" and rowSelection != None:
+            backend = self.__registry.getSelectBackend(self.__codecName)
+            if backend != None:
+                rowElements, start, stop, step = rowSelection
+                ranges = [
+                    (row * rowElements, (row + 1) * rowElements)
+                    for row in range(start, stop, step)
+                ]
+                outarray = self.__bufferPool.getBuffer(
+                    dtype, int(uncompressed / elementsize)
+                )
+                backend.decompressSelected(inarray, outarray, elementsize, ranges)
+                self.__clearUnselected(outarray, elementsize, rowSelection)
+                self.__rowSelection = rowSelection
+        if self.__codecName == "jpeg" and scaleHint >= 2:
+            # the total decimation must stay scaleHint
+            scale = 8
+            while int(scaleHint) % scale != 0:
+                scale = int(scale / 2)
+            backend = self.__registry.getScaleBackend(self.__codecName)
+            if backend != None and scale >= 2:
+                shape = backend.getScaledShape(inarray, scale)
+                outarray = self.__bufferPool.getBuffer(
+                    np.uint8, shape[0] * shape[1] * shape[2]
+                )
+                backend.decompressScaled(inarray, outarray, scale)
+                self.__scale = scale
+        if self.__scale == 1 and self.__rowSelection == None:
+            if self.__codecName == "jpeg":
+                outarray = self.__bufferPool.getBuffer(np.uint8, uncompressed)
+            else:
+                outarray = self.__bufferPool.getBuffer(
+                    dtype, int(uncompressed / elementsize)
+                )
+            backend = self.__registry.decompress(
+                self.__codecName, inarray, outarray, elementsize
             )
-            data = np.array(outarray)
-            data = data.flatten()
-        else:
-            raise Exception(self.__codecName + " is unsupported codec")
+            self.__bufferPool.setWritten(outarray, None)
+        self.__backendName = backend.getBackendName()
+        data = outarray
         self.__compressRatio = round(float(uncompressed / compressed))
         self.__data = data
-        return True
+
+    def __clearUnselected(self, outarray, elementsize, rowSelection):
+        # A reused buffer still holds an earlier frame in the rows that were not decoded.
+        # The pool remembers which rows of each buffer may not be zero, so only those rows
+        # and the rows that share a block with a selected row are cleared.
+        rowElements, start, stop, step = rowSelection
+        num = outarray.size // rowElements
+        rows = outarray[: num * rowElements].reshape(num, rowElements)
+        selected = np.zeros(num, dtype=bool)
+        selected[start:stop:step] = True
+        written = self.__bufferPool.getWritten(outarray)
+        if written is None:
+            # a new buffer or one that held a full frame
+            written = np.ones(num, dtype=bool)
+            outarray[num * rowElements :] = 0
+        # rows decoded because they share a block with a selected row
+        blockSize = Bslz4Blocks.getBlockSize(elementsize)
+        numBlocks = outarray.size // blockSize
+        first = np.arange(start, stop, step, dtype=np.int64)
+        if first.size > 0:
+            firstBlock = first * rowElements // blockSize
+            endBlock = ((first + 1) * rowElements - 1) // blockSize + 1
+            endElement = np.where(endBlock > numBlocks, outarray.size, endBlock * blockSize)
+            bounds = np.zeros(num + 1, dtype=np.int64)
+            np.add.at(bounds, firstBlock * blockSize // rowElements, 1)
+            np.add.at(bounds, np.minimum((endElement - 1) // rowElements + 1, num), -1)
+            written |= np.cumsum(bounds[:num]) > 0
+        clear = written & ~selected
+        if clear.any():
+            rows[clear] = 0
+        self.__bufferPool.setWritten(outarray, selected)
+
+    def compress(
+        self, data, codecName, level=5, shuffle=1, compressor="blosclz", quality=85
+    ):
+        """
+        compress data and create the NTNDArray fields that describe the result.
+        This is the inverse of decompress and is meant for python code that
+        publishes NTNDArray data.
+
+        Parameters
+        ----------
+            data :       numpy array with one of the dtypes supported by decompress.
+                         For jpeg it must be uint8 with shape (ny,nx) or (ny,nx,3).
+            codecName :  "blosc", "blosc2", "lz4", "bslz4", "zstd", or "jpeg"
+            level :      blosc and blosc2 compression level 0,...,9, zstd level 1,...,22
+            shuffle :    blosc and blosc2 shuffle 0 (none), 1 (byte), or 2 (bit)
+            compressor : blosc and blosc2 compressor, e.g. "blosclz", "lz4", "lz4hc", "zlib", "zstd"
+            quality :    jpeg quality 1,...,100
+
+        Returns
+        -------
+            result : dict
+                result["value"]            numpy uint8 array with the compressed data
+                result["codec"]            {"name": codecName, "parameters": dtype code}
+                result["compressedSize"]   number of bytes in result["value"]
+                result["uncompressedSize"] number of bytes in data
+        """
+        data = np.ascontiguousarray(data)
+        typevalue = None
+        for key, value in self.__typeMap.items():
+            if np.dtype(value) == data.dtype:
+                typevalue = key
+        if typevalue == None:
+            raise Exception("compress unsupported dtype " + str(data.dtype))
+        if codecName == "jpeg":
+            if data.dtype != np.uint8:
+                raise Exception("jpeg requires dtype uint8")
+            if data.ndim != 2 and not (data.ndim == 3 and data.shape[2] == 3):
+                raise Exception("jpeg requires shape (ny,nx) or (ny,nx,3)")
+        options = {
+            "level": int(level),
+            "shuffle": int(shuffle),
+            "compressor": compressor,
+            "quality": int(quality),
+        }
+        compressed = self.__registry.compress(codecName, data, options)
+        return {
+            "value": compressed,
+            "codec": {"name": codecName, "parameters": typevalue},
+            "compressedSize": compressed.nbytes,
+            "uncompressedSize": data.nbytes,
+        }
+
+    class __BufferPool:
+        # A buffer is free when the pool holds the only reference to it.
+        # Any other reference, e.g. getData, a CodecFrame, or a numpy view such as
+        # a reshape of the data, keeps the buffer from being reused.
+        # Such a buffer is never overwritten; a new buffer is allocated instead.
+        def __init__(self, numBuffers):
+            self.numBuffers = max(int(numBuffers), 1)
+            self.key = None
+            self.buffers = list()
+            self.next = 0
+            # id(buffer) : rows of a row selected decode that may not be zero
+            self.written = dict()
+
+        def getWritten(self, buffer):
+            return self.written.get(id(buffer))
+
+        def setWritten(self, buffer, written):
+            # only buffers kept by the pool are tracked. None means all rows.
+            self.written.pop(id(buffer), None)
+            if written is not None and any(b is buffer for b in self.buffers):
+                self.written[id(buffer)] = written
+
+        def getBuffer(self, dtype, nelements):
+            key = (np.dtype(dtype), nelements)
+            if key != self.key:
+                # buffers still referenced by a client are kept alive by the client
+                self.key = key
+                self.buffers = list()
+                self.next = 0
+                self.written = dict()
+            num = len(self.buffers)
+            for i in range(num):
+                index = (self.next + i) % num
+                buffer = self.buffers[index]
+                # references are self.buffers, buffer, and the getrefcount argument
+                if sys.getrefcount(buffer) <= 3:
+                    self.next = (index + 1) % num
+                    return buffer
+            buffer = np.empty(nelements, dtype=dtype)
+            if num < self.numBuffers:
+                self.buffers.append(buffer)
+                self.next = 0
+            return buffer
+
+
+class CodecFrame:
+    """
+    CodecFrame holds one NTNDArray frame as it was received.
+    The value stays compressed until decompress is called,
+    so a frame that is replaced by a newer frame before it is used is never decoded.
+
+    Normal use is:
+    ...
+        def callback(self, arg):
+            " keep only the latest frame"
+            self.frame = CodecFrame(arg)
+    ...
+        def process(self):
+            data = self.frame.decompress(self.codecAD)
+    ...
+    """
+
+    def __init__(self, arg):
+        """
+         Parameters
+        -----------
+            arg : dict
+                 value, codec, compressedSize, uncompressedSize, and dimension
+                 from the NTNDArray record. attribute is optional.
+        """
+        self.__value = arg["value"]
+        self.__attribute = arg.get("attribute")
+        self.__codec = arg["codec"]
+        self.__compressed = arg["compressedSize"]
+        self.__uncompressed = arg["uncompressedSize"]
+        self.__dimension = arg["dimension"]
+        self.__data = None
+        self.__decodeArgs = None
+
+    def getDimension(self):
+        """
+        Returns
+        -------
+        dimension :
+            the dimension field of the NTNDArray
+        """
+        return self.__dimension
+
+    def getAttribute(self, name, default=None):
+        """
+         Parameters
+        -----------
+            name : str
+                 name of an NDAttribute, e.g. "ColorMode"
+            default :
+                 returned if the frame does not have the attribute
+
+        Returns
+        -------
+            value :
+                 the value of the attribute
+        """
+        if self.__attribute == None:
+            return default
+        for attribute in self.__attribute:
+            if attribute["name"] != name:
+                continue
+            value = attribute["value"]
+            # pvapy returns a variant as a tuple with a dict
+            if isinstance(value, (tuple, list)) and len(value) > 0:
+                value = value[0]
+            if isinstance(value, dict) and len(value) > 0:
+                value = list(value.values())[0]
+            return value
+        return default
+
+    def getCodecName(self):
+        """
+        Returns
+        -------
+        codecName : str
+            name of the codec, "" if the value is not compressed
+        """
+        return self.__codec["name"]
+
+    def isCompressed(self):
+        """
+        Returns
+        -------
+        isCompressed : bool
+            True if decompress must decode the value
+        """
+        return len(self.__codec["name"]) > 0
+
+    def isDecoded(self):
+        """
+        Returns
+        -------
+        isDecoded : bool
+            True if decompress has already been called
+        """
+        return self.__decodeArgs != None
+
+    def decompress(self, codecAD, scaleHint=1, rowSelection=None):
+        """
+        decompress the frame by calling codecAD.decompress.
+        The frame is only decoded again if it is called with different arguments.
+        codecAD.getCodecName etc. describe the last frame passed to codecAD.
+
+         Parameters
+        -----------
+            codecAD : CodecAD
+            scaleHint, rowSelection : see CodecAD.decompress
+
+        Returns
+        -------
+            data : numpy array
+                 the decompressed data, or the value if it is not compressed
+        """
+        decodeArgs = (id(codecAD), scaleHint, rowSelection)
+        if decodeArgs == self.__decodeArgs:
+            return self.__data
+        if codecAD.decompress(
+            self.__value,
+            self.__codec,
+            self.__compressed,
+            self.__uncompressed,
+            scaleHint=scaleHint,
+            rowSelection=rowSelection,
+        ):
+            self.__data = codecAD.getData()
+        else:
+            self.__data = self.__value
+        self.__decodeArgs = decodeArgs
+        return self.__data
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+codecBenchmark measures how fast CodecAD decompresses each codec.
+
+For every codec, dtype, and frame size a synthetic NTNDArray like payload is
+created and compressed locally by CodecAD.compress. It is then decompressed by every available
+backend and the following is reported:
+    MB/s         uncompressed megabytes per second
+    frames/s     decompressed frames per second
+    allocations  bytes allocated by one decompress as a multiple of the frame size
+
+Normal use is:
+    python codecBenchmark.py
+    python codecBenchmark.py --sizes 512,2048 --codecs bslz4,blosc --json result.json --csv result.csv
+
+In order to use the ADSupport libraries LD_LIBRARY_PATH must be defined as described in codecAD.py
+
+Copyright - See the COPYRIGHT that is included with this distribution.
+    NTNDA_Viewer is distributed subject to a Software License Agreement found
+    in file LICENSE that is included with this distribution.
+"""
+
+import sys
+import os
+import time
+import json
+import csv
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from codecAD import CodecAD
+
+# the codec["parameters"] values defined by areaDetector
+dtypeCodes = {
+    1: "int8",
+    2: "int16",
+    3: "int32",
+    4: "int64",
+    5: "uint8",
+    6: "uint16",
+    7: "uint32",
+    8: "uint64",
+    9: "float32",
+    10: "float64",
+}
+
+
+def createImage(dtype, size):
+    """
+    create a size by size image similar to the simDetector peaks mode
+    """
+    y, x = np.mgrid[0:size, 0:size].astype(np.float64)
+    image = np.zeros((size, size))
+    step = max(size // 8, 1)
+    for cy in range(step // 2, size, step):
+        for cx in range(step // 2, size, step):
+            image += np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2.0 * (step / 6.0) ** 2))
+    image += np.random.default_rng(size).normal(0.0, 0.02, image.shape)
+    info = np.finfo(dtype) if np.dtype(dtype).kind == "f" else np.iinfo(dtype)
+    high = min(float(info.max), 60000.0)
+    low = 0.0 if np.dtype(dtype).kind == "u" else -high / 4
+    image = low + np.clip(image, 0.0, 1.0) * (high - low)
+    return image.astype(dtype)
+
+
+def createPayload(codecAD, codecName, typevalue, size):
+    """
+    Returns a dict with the NTNDArray fields used by CodecAD.decompress or None
+    """
+    image = createImage(dtypeCodes[typevalue], size)
+    if codecName == "jpeg" and image.dtype != np.uint8:
+        return None
+    try:
+        payload = codecAD.compress(image, codecName, compressor="lz4")
+    except Exception as error:
+        print(codecName, dtypeCodes[typevalue], "compress failed", str(error))
+        return None
+    payload["dimension"] = [{"size": size}, {"size": size}]
+    return payload
+
+
+def measure(codecAD, payload, repeat):
+    args = (
+        payload["value"],
+        payload["codec"],
+        payload["compressedSize"],
+        payload["uncompressedSize"],
+    )
+    codecAD.decompress(*args)
+    elapsed = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        codecAD.decompress(*args)
+        now = time.perf_counter() - start
+        if elapsed == None or now < elapsed:
+            elapsed = now
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    codecAD.decompress(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    uncompressed = payload["uncompressedSize"]
+    return {
+        "seconds": elapsed,
+        "MBperSec": uncompressed / elapsed / 1e6,
+        "framesPerSec": 1.0 / elapsed,
+        "allocatedBytes": peak - before,
+        "allocations": round((peak - before) / uncompressed, 2),
+        "compressRatio": round(uncompressed / payload["compressedSize"], 2),
+    }
+
+
+def run(codecs, typevalues, sizes, repeat, numThreads):
+    codecAD = CodecAD(numThreads=numThreads)
+    registry = codecAD.getRegistry()
+    host = {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "numThreads": numThreads,
+    }
+    results = list()
+    for codecName in codecs:
+        backendNames = registry.getBackendNames(codecName)
+        for typevalue in typevalues:
+            for size in sizes:
+                payload = createPayload(codecAD, codecName, typevalue, size)
+                if payload is None:
+                    continue
+                for backendName in backendNames:
+                    registry.setBackend(codecName, backendName)
+                    result = {
+                        "codec": codecName,
+                        "backend": backendName,
+                        "dtype": dtypeCodes[typevalue],
+                        "size": size,
+                        "uncompressedSize": payload["uncompressedSize"],
+                    }
+                    try:
+                        result.update(measure(codecAD, payload, repeat))
+                        result["error"] = ""
+                    except Exception as error:
+                        result["error"] = str(error)
+                    result.update(host)
+                    results.append(result)
+                    report(result)
+        registry.setBackend(codecName, None)
+    return results
+
+
+def report(result):
+    if len(result["error"]) > 0:
+        print(
+            "%-6s %-10s %-8s %6d  error %s"
+            % (result["codec"], result["backend"], result["dtype"], result["size"], result["error"])
+        )
+        return
+    print(
+        "%-6s %-10s %-8s %6d %10.1f MB/s %9.1f frames/s %6.2f allocations"
+        % (
+            result["codec"],
+            result["backend"],
+            result["dtype"],
+            result["size"],
+            result["MBperSec"],
+            result["framesPerSec"],
+            result["allocations"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark CodecAD decompression")
+    parser.add_argument("--codecs", default="blosc,blosc2,lz4,bslz4,zstd,jpeg")
+    parser.add_argument("--dtypes", default=",".join(str(i) for i in dtypeCodes))
+    parser.add_argument("--sizes", default="256,1024,2048")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--json", default=None, help="write results to this json file")
+    parser.add_argument("--csv", default=None, help="write results to this csv file")
+    args = parser.parse_args()
+    results = run(
+        args.codecs.split(","),
+        [int(i) for i in args.dtypes.split(",")],
+        [int(i) for i in args.sizes.split(",")],
+        args.repeat,
+        args.threads,
+    )
+    if args.json != None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.csv != None and len(results) > 0:
+        names = list()
+        for result in results:
+            for name in result:
+                if name not in names:
+                    names.append(name)
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=names)
+            writer.writeheader()
+            writer.writerows(results)
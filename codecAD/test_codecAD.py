@@ -0,0 +1,99 @@
+"""
+tests for CodecAD
+
+    python -m pytest -q test_codecAD.py
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from codecAD import CodecAD
+
+
+def decompressArgs(payload):
+    return (
+        payload["value"],
+        payload["codec"],
+        payload["compressedSize"],
+        payload["uncompressedSize"],
+    )
+
+
+def testBufferReusedWhenNotReferenced():
+    codecAD = CodecAD(numBuffers=1)
+    payload = codecAD.compress(np.arange(4096, dtype=np.uint16), "lz4")
+    codecAD.decompress(*decompressArgs(payload))
+    first = id(codecAD.getData())
+    codecAD.decompress(*decompressArgs(payload))
+    assert id(codecAD.getData()) == first
+
+
+def testReferencedBufferNotOverwritten():
+    codecAD = CodecAD(numBuffers=1)
+    image = np.arange(4096, dtype=np.uint16)
+    codecAD.decompress(*decompressArgs(codecAD.compress(image, "lz4")))
+    # a view also references the buffer
+    kept = codecAD.getData().reshape(64, 64)
+    codecAD.decompress(*decompressArgs(codecAD.compress(image[::-1].copy(), "lz4")))
+    assert not np.shares_memory(kept, codecAD.getData())
+    assert np.array_equal(kept.reshape(-1), image)
+
+
+def testRowSelectionClearsOtherRows():
+    codecAD = CodecAD(numBuffers=1)
+    if codecAD.getRegistry().getSelectBackend("bslz4") == None:
+        pytest.skip("no bslz4 backend that can select rows")
+    nx = 256
+    ny = 256
+    rng = np.random.default_rng(0)
+    previous = rng.integers(1, 1000, (ny, nx), dtype=np.uint16)
+    image = rng.integers(1, 1000, (ny, nx), dtype=np.uint16)
+    codecAD.decompress(*decompressArgs(codecAD.compress(previous, "bslz4")))
+    first = id(codecAD.getData())
+    rowSelection = (nx, 16, 200, 3)
+    codecAD.decompress(
+        *decompressArgs(codecAD.compress(image, "bslz4")), rowSelection=rowSelection
+    )
+    data = codecAD.getData()
+    # the buffer of the previous frame was reused
+    assert id(data) == first
+    assert codecAD.getRowSelection() == rowSelection
+    rows = data.reshape(ny, nx)
+    selected = np.zeros(ny, dtype=bool)
+    selected[16:200:3] = True
+    assert np.array_equal(rows[selected], image[selected])
+    assert not rows[~selected].any()
+
+
+def testChangingRowSelections():
+    # only the rows an earlier selection decoded are cleared, the result stays exact
+    codecAD = CodecAD(numBuffers=1)
+    if codecAD.getRegistry().getSelectBackend("bslz4") == None:
+        pytest.skip("no bslz4 backend that can select rows")
+    nx = 100
+    ny = 300
+    rng = np.random.default_rng(1)
+    selections = [(16, 200, 3), None, (250, 300, 2), (0, 300, 7), (100, 120, 1), (5, 6, 1)]
+    buffers = set()
+    for selection in selections:
+        image = rng.integers(1, 1000, (ny, nx), dtype=np.uint16)
+        args = decompressArgs(codecAD.compress(image, "bslz4"))
+        if selection == None:
+            codecAD.decompress(*args)
+            assert np.array_equal(codecAD.getData().reshape(ny, nx), image)
+            continue
+        rowSelection = (nx,) + selection
+        codecAD.decompress(*args, rowSelection=rowSelection)
+        rows = codecAD.getData().reshape(ny, nx)
+        buffers.add(id(codecAD.getData()))
+        selected = np.zeros(ny, dtype=bool)
+        selected[slice(*selection)] = True
+        assert np.array_equal(rows[selected], image[selected])
+        assert not rows[~selected].any()
+        # the pool only reuses a buffer that is not referenced
+        del rows
+    # every frame was decoded into the one pooled buffer
+    assert len(buffers) == 1
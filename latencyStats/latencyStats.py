@@ -0,0 +1,203 @@
+# latencyStats.py
+"""
+latencyStats measures how long each stage of an image pipeline takes.
+A stage is timed with time.perf_counter_ns, so a stamp costs well under a microsecond.
+For each stage the last window samples are kept and p50, p95, and p99 are computed
+when the statistics are read.
+
+The stages used by NTNDA_Viewer are:
+    receive         provider callback until the viewer callback in the gui thread
+    decompress      CodecFrame.decompress
+    channelToImage  ChannelToImageAD.channelToImage
+    build           NumpyImage creates the QImage
+    scale           NumpyImage scales the image to the window
+    paint           NumpyImage.paintEvent
+
+Normal use is:
+...
+from latencyStats import LatencyStats
+...
+    self.latencyStats = LatencyStats()
+...
+    start = self.latencyStats.stamp()
+    data = self.codecAD.decompress(...)
+    self.latencyStats.addSince("decompress", start)
+...
+    statistics = self.latencyStats.getStatistics("decompress")
+    " statistics["p95"] is in milliseconds"
+    self.latencyStats.writeCsv("latency.csv")
+...
+
+Copyright - See the COPYRIGHT that is included with this distribution.
+    NTNDA_Viewer is distributed subject to a Software License Agreement found
+    in file LICENSE that is included with this distribution.
+"""
+
+import time
+import csv
+import threading
+import numpy as np
+
+
+class LatencyStats:
+    """
+    LatencyStats keeps a rolling window of latencies for each stage.
+    Stages can be added from any thread.
+    """
+
+    # percentiles returned by getStatistics
+    percentiles = (50, 95, 99)
+
+    def __init__(self, window=1000):
+        """
+         Parameters
+        -----------
+            window : int
+                 number of samples kept for each stage
+        """
+        self.__window = max(int(window), 1)
+        self.__lock = threading.Lock()
+        self.__stages = dict()
+
+    def __createStageDict(self):
+        return {
+            "samples": np.zeros(self.__window, dtype=np.int64),
+            "next": 0,
+            "count": 0,
+            "totalNs": 0,
+        }
+
+    def stamp(self):
+        """
+        Returns
+        -------
+            stamp : int
+                 time.perf_counter_ns() to pass to addSince
+        """
+        return time.perf_counter_ns()
+
+    def add(self, stage, nanoseconds):
+        """
+         Parameters
+        -----------
+            stage : str
+                 name of the stage
+            nanoseconds : int
+                 time that the stage took
+        """
+        with self.__lock:
+            stageDict = self.__stages.get(stage)
+            if stageDict == None:
+                stageDict = self.__createStageDict()
+                self.__stages[stage] = stageDict
+            stageDict["samples"][stageDict["next"]] = nanoseconds
+            stageDict["next"] = (stageDict["next"] + 1) % self.__window
+            stageDict["count"] += 1
+            stageDict["totalNs"] += nanoseconds
+
+    def addSince(self, stage, stamp):
+        """
+        add the time since stamp, which was returned by stamp, to stage
+        """
+        self.add(stage, time.perf_counter_ns() - stamp)
+
+    def reset(self):
+        """ discard all samples """
+        with self.__lock:
+            self.__stages = dict()
+
+    def getStageNames(self):
+        """
+        Returns
+        -------
+        stageNames : list
+            names of the stages in the order they were first added
+        """
+        with self.__lock:
+            return list(self.__stages.keys())
+
+    def getSamples(self, stage):
+        """
+        Returns
+        -------
+        samples : numpy array
+            copy of the nanoseconds in the window for stage, oldest first
+        """
+        with self.__lock:
+            stageDict = self.__stages.get(stage)
+            if stageDict == None:
+                return np.zeros(0, dtype=np.int64)
+            num = min(stageDict["count"], self.__window)
+            return np.roll(stageDict["samples"], -stageDict["next"])[self.__window - num :]
+
+    def getStatistics(self, stage):
+        """
+        Returns
+        -------
+        statistics : dict
+            statistics["count"]  number of samples since reset
+            statistics["mean"]   mean milliseconds since reset
+            statistics["p50"]    milliseconds for each of percentiles over the window
+            statistics["p95"]
+            statistics["p99"]
+            statistics["max"]    maximum milliseconds over the window
+            All times are 0.0 if the stage has no samples.
+        """
+        samples = self.getSamples(stage)
+        with self.__lock:
+            stageDict = self.__stages.get(stage, self.__createStageDict())
+            count = stageDict["count"]
+            totalNs = stageDict["totalNs"]
+        statistics = {"count": count, "mean": 0.0}
+        for percentile in self.percentiles:
+            statistics["p" + str(percentile)] = 0.0
+        statistics["max"] = 0.0
+        if samples.size == 0:
+            return statistics
+        statistics["mean"] = totalNs / count / 1e6
+        values = np.percentile(samples, self.percentiles) / 1e6
+        for percentile, value in zip(self.percentiles, values):
+            statistics["p" + str(percentile)] = float(value)
+        statistics["max"] = float(samples.max()) / 1e6
+        return statistics
+
+    def getSummary(self):
+        """
+        Returns
+        -------
+        summary : str
+            one line with p50/p95/p99 in milliseconds for each stage
+        """
+        items = list()
+        for stage in self.getStageNames():
+            statistics = self.getStatistics(stage)
+            items.append(
+                "%s %.2f/%.2f/%.2f"
+                % (stage, statistics["p50"], statistics["p95"], statistics["p99"])
+            )
+        return "p50/p95/p99 ms: " + ", ".join(items)
+
+    def writeCsv(self, filename, samples=False):
+        """
+         Parameters
+        -----------
+            filename : str
+                 the csv file to write
+            samples : True or False
+                 If False one row with the statistics is written for each stage.
+                 If True one row is written for each sample in the window
+                 with columns stage and milliseconds.
+        """
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            if samples:
+                writer.writerow(["stage", "milliseconds"])
+                for stage in self.getStageNames():
+                    for value in self.getSamples(stage):
+                        writer.writerow([stage, value / 1e6])
+                return
+            names = ["count", "mean"] + ["p" + str(p) for p in self.percentiles] + ["max"]
+            writer.writerow(["stage"] + names)
+            for stage in self.getStageNames():
+                statistics = self.getStatistics(stage)
+                writer.writerow([stage] + [statistics[name] for name in names])